@@ -0,0 +1,157 @@
+import functools
+import threading
+import time
+import globals as g
+
+'''
+Description: Thread-safe token bucket: `rate` tokens per second, holding at most `burst` tokens.
+'''
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    '''
+    Description: Takes one token, sleeping until one is available.
+    Outputs: waited (float) - The seconds spent waiting.
+    '''
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+'''
+Description: AWS API budget of the process: one token bucket per operation, shared by every client it is attached to,
+             so that all modules of the process together stay under the operation's rate limit instead of being throttled.
+             Other processes using the same account have their own budget, so the rates must be this process's share of the limit.
+Inputs:
+    rates (dict) - A mapping of operation name (e.g. 'DescribeInstances') to (rate per second, burst).
+    default_rate (tuple) - The (rate per second, burst) of operations not in `rates`.
+'''
+class ApiBudget:
+    def __init__(self, rates: dict, default_rate: tuple):
+        self.rates = rates
+        self.default_rate = default_rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _get_bucket(self, operation_name: str):
+        with self.lock:
+            bucket = self.buckets.get(operation_name)
+            if bucket is None:
+                bucket = self.buckets[operation_name] = TokenBucket(*self.rates.get(operation_name, self.default_rate))
+            return bucket
+
+    '''
+    Description: Takes a token for one call of an operation, waiting if the operation's budget is used up.
+    Inputs: operation_name (str) - The operation, e.g. 'RegisterTargets'.
+    '''
+    def acquire(self, operation_name: str):
+        waited = self._get_bucket(operation_name).acquire()
+        if waited > 0.5:
+            print(f"AWS API budget: waited {waited:.2f} seconds for {operation_name}")
+
+    def _before_call(self, model, **kwargs):
+        self.acquire(model.name)
+
+    '''
+    Description: Makes every API call of a boto3 client take a token from this budget before it is sent.
+    Inputs: client (boto3.client) - The client to attach to.
+    '''
+    def attach(self, client):
+        client.meta.events.register('before-call', self._before_call)
+
+'''
+Description: Memoises a function whose result never changes for given arguments, such as a target group ARN lookup.
+             Failures are not cached.
+Inputs: function (callable) - The function to memoise; its arguments must be hashable.
+Outputs: wrapper (callable) - The memoised function.
+'''
+def memoize(function):
+    cache = {}
+
+    @functools.wraps(function)
+    def wrapper(*args):
+        if args not in cache:
+            cache[args] = function(*args)
+        return cache[args]
+    return wrapper
+
+'''
+Description: Queues target registration changes and applies them in as few calls as possible: per target group, at most one
+             register_targets and one deregister_targets call per flush, skipping targets already in the requested state.
+             The known state is forgotten every `resync_interval` seconds so that changes made elsewhere get corrected.
+Inputs:
+    elb_client (boto3.client) - The ELB client instance.
+    resync_interval (float) - Seconds after which every queued target is sent again, even if it was already in that state.
+'''
+class RegistrationBatcher:
+    def __init__(self, elb_client, resync_interval: float = 60):
+        self.elb_client = elb_client
+        self.resync_interval = resync_interval
+        self.pending = {}
+        self.registered = {}
+        self.last_resync = time.monotonic()
+        self.lock = threading.Lock()
+
+    '''
+    Description: Queues registrations and deregistrations for a target group; a later change of the same target wins.
+    Inputs:
+        target_group_arn (str) - The ARN of the target group.
+        register_ids (list) - The instance IDs to register.
+        deregister_ids (list) - The instance IDs to deregister.
+    '''
+    def queue(self, target_group_arn: str, register_ids: list, deregister_ids: list):
+        with self.lock:
+            pending = self.pending.setdefault(target_group_arn, {})
+            for instance_id in deregister_ids:
+                pending[instance_id] = False
+            for instance_id in register_ids:
+                pending[instance_id] = True
+
+    '''
+    Description: Applies the queued changes.
+    Outputs: calls (int) - The number of API calls made.
+    '''
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if time.monotonic() - self.last_resync >= self.resync_interval:
+                self.registered = {}
+                self.last_resync = time.monotonic()
+
+        calls = 0
+        for target_group_arn, changes in pending.items():
+            known = self.registered.get(target_group_arn)
+            to_register = [i for i, register in changes.items() if register and (known is None or i not in known)]
+            to_deregister = [i for i, register in changes.items() if not register and (known is None or i in known)]
+
+            # Register first, so that the group keeps a serving target while the new one passes its health check
+            if to_register:
+                self.elb_client.register_targets(TargetGroupArn=target_group_arn, Targets=[{'Id': i} for i in to_register])
+                calls += 1
+            if to_deregister:
+                self.elb_client.deregister_targets(TargetGroupArn=target_group_arn, Targets=[{'Id': i} for i in to_deregister])
+                calls += 1
+
+            # Only targets this batcher has set are known; others are left alone until queued
+            known = set(known or ())
+            known.update(i for i, register in changes.items() if register)
+            known.difference_update(i for i, register in changes.items() if not register)
+            self.registered[target_group_arn] = known
+        return calls
+
+# The budget shared by every client created through aws_clients
+budget = ApiBudget(g.aws_api_rates, g.aws_api_default_rate)
@@ -0,0 +1,64 @@
+import threading
+import boto3
+from botocore.config import Config
+import aws_api_budget
+
+# Adaptive retries back off and rate limit client side when AWS throttles, instead of failing the call.
+# The pool is sized for the concurrent probes, watchers and benchmark helpers that share a client.
+CLIENT_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    max_pool_connections=50,
+)
+
+_session = None
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+'''
+Description: Returns a shared boto3 client for a service and region, creating it on first use.
+             Clients are thread safe, so one client per service and region is reused by every module.
+             Every call made through the client takes a token from the process's AWS API budget.
+Inputs:
+    service_name (str) - The AWS service, e.g. 'ec2' or 'elbv2'.
+    region_name (str) - The AWS region, or None for the configured default region.
+Outputs: client (boto3.client) - The cached client.
+'''
+def get_client(service_name: str, region_name: str = None):
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        # Creating clients through a shared session is not thread safe
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service_name, region_name=region_name, config=CLIENT_CONFIG)
+                aws_api_budget.budget.attach(client)
+                _clients[key] = client
+    return client
+
+'''
+Description: Returns a shared boto3 resource for a service and region, creating it on first use.
+             Resources are not thread safe, only use the shared resource from the main thread.
+Inputs:
+    service_name (str) - The AWS service, e.g. 'ec2'.
+    region_name (str) - The AWS region, or None for the configured default region.
+Outputs: resource (boto3.resource) - The cached resource.
+'''
+def get_resource(service_name: str, region_name: str = None):
+    key = (service_name, region_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _get_session().resource(service_name, region_name=region_name, config=CLIENT_CONFIG)
+                aws_api_budget.budget.attach(resource.meta.client)
+                _resources[key] = resource
+    return resource
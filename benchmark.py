@@ -1,8 +1,15 @@
 import asyncio
 import aiohttp
 import time
-import boto3
+import argparse
+import aws_api_budget
+import aws_clients
 import globals as g
+import traffic_trace as tt
+import benchmark_store as bs
+import soak_test as st
+import outlier_detection as od
+import connection_matrix as cm
 from datetime import datetime, timedelta
 
 
@@ -37,29 +44,94 @@ def get_cpu_utilization(cloudwatch_client, instance_id):
         return None
 
 
-async def call_endpoint_http(session, request_num, endpoint, dns_name):
+async def call_endpoint_http(session, request_num, endpoint, dns_name, recorder=None):
     url = f"http://{dns_name}{endpoint}"
     headers = {'content-type': 'application/json'}
+    sent_at = time.monotonic()
     try:
         async with session.get(url, headers=headers) as response:
             status_code = response.status
             response_json = await response.json()
-            print(f"Request {request_num} to {endpoint}: Response: {response_json}")
-            return status_code, response_json
+            latency = time.monotonic() - sent_at
+            print(f"Request {request_num} to {endpoint}: Response: {response_json} in {latency:.4f}s")
+            if recorder is not None:
+                recorder.record(endpoint, tt.get_backend_id(response_json), sent_at)
+            return status_code, response_json, latency
     except Exception as e:
         print(f"Request {request_num} to {endpoint}: Failed - {str(e)}")
-        return None, str(e)
+        if recorder is not None:
+            recorder.record(endpoint, None, sent_at)
+        return None, str(e), time.monotonic() - sent_at
 
 
+def summarize_results(results, total_time):
+    """
+    Summarizes the (status, response, latency) results of a burst for the benchmark store.
+
+    :param results: The results returned by call_endpoint_http
+    :param total_time: Wall clock time of the burst in seconds
+    :return: The endpoint summary with its latency histogram
+    """
+    latencies = [latency for status_code, _, latency in results if status_code == 200]
+    return bs.summarize_endpoint(latencies, len(results) - len(latencies), total_time)
+
+
+def to_result(endpoint, result):
+    """
+    Converts a (status, response, latency) result of call_endpoint_http into the result dict used by the analyzers.
+
+    :param endpoint: The endpoint the request was sent to
+    :param result: The result returned by call_endpoint_http
+    :return: A dict with the path, backend, status and latency of the request
+    """
+    status_code, response_json, latency = result
+    backend_id = tt.get_backend_id(response_json) if status_code == 200 else None
+    return {'path': endpoint, 'backend': backend_id, 'status': status_code, 'latency': latency}
+
+
+def print_fairness_report(results):
+    """
+    Prints how the requests were spread over the instances of each cluster, see fairness_analyzer.py.
+    The analyzer needs NumPy, which is imported only here so that the benchmark runs without it.
+
+    :param results: Dicts with 'path', 'backend' and 'latency' keys
+    """
+    try:
+        import fairness_analyzer as fa
+    except ImportError:
+        print("Skipping the fairness report: install numpy to enable it")
+        return
+    fa.print_report(fa.analyze(*fa.from_results(results)), 100)
+
+
+def get_cluster_instance_types(ec2_client, target_healths):
+    """
+    Looks up the instance types of the registered targets of each target group.
+
+    :param ec2_client: The EC2 client
+    :param target_healths: A mapping of target group name to its target health descriptions
+    :return: A mapping of target group name to {instance ID: instance type}
+    """
+    instance_types = {}
+    for target_group_name, targets in target_healths.items():
+        try:
+            instance_types[target_group_name] = bs.get_instance_types(ec2_client, [target['Target']['Id'] for target in targets or []])
+        except Exception as e:
+            print(f"Error fetching instance types for {target_group_name}: {str(e)}")
+            instance_types[target_group_name] = {}
+    return instance_types
+
+
+@aws_api_budget.memoize
 def get_target_group_arn(target_group_name):
     """
-    Retrieves the ARN of the target group by its name.
+    Retrieves the ARN of the target group by its name, looked up once per name.
 
     :param target_group_name: The name of the target group
     :return: The ARN of the target group
     """
-    # Initialize a Boto3 client for the Elastic Load Balancing service
-    client = boto3.client('elbv2')
+    # Get the shared client for the Elastic Load Balancing service
+    client = aws_clients.get_client('elbv2')
 
     # Describe the target group by name
     response = client.describe_target_groups(Names=[target_group_name])
@@ -70,13 +142,13 @@ def get_target_group_arn(target_group_name):
     return target_group_arn
 
 
-async def main():
-    num_requests = 1000
-
-    # Initialize the ELB and CloudWatch clients
-    elb_client = boto3.client('elbv2')
-    cloudwatch_client = boto3.client('cloudwatch')
+def get_load_balancer_dns_name(elb_client):
+    """
+    Retrieves the DNS name of the load balancer named in globals.
 
+    :param elb_client: The ELB client
+    :return: The DNS name of the load balancer
+    """
     # Describe the load balancer
     response = elb_client.describe_load_balancers(
         Names=[g.load_balancer_name]
@@ -84,7 +156,137 @@ async def main():
 
     # Extract the DNS name for the specific load balancer
     load_balancer = response['LoadBalancers'][0]
-    dns_name = load_balancer['DNSName']
+    return load_balancer['DNSName']
+
+
+async def replay(trace_path, speed=1.0, max_connections=100, outcome_log_path=None, outcome_host=None):
+    """
+    Replays a recorded trace against the load balancer and prints a summary.
+
+    :param trace_path: The trace file to replay
+    :param speed: Replay speed factor, 0 to send without pacing
+    :param max_connections: The maximum number of concurrent connections
+    :param outcome_log_path: A file each response outcome is appended to as it completes, for the traffic manager's outlier detection
+    :param outcome_host: The traffic manager's instance, the outcome log is then written there over SFTP (relative to the home directory)
+    :return: The per-request replay results
+    """
+    elb_client = aws_clients.get_client('elbv2')
+    dns_name = get_load_balancer_dns_name(elb_client)
+    entries = tt.read_trace(trace_path)
+    print(f"Replaying {len(entries)} requests from {trace_path} at speed {speed} with up to {max_connections} connections...")
+
+    outcome_log = None
+    runner = None
+    if outcome_log_path and outcome_host:
+        # paramiko is only needed to write the log on another host
+        import fleet_runner as fr
+        runner = fr.FleetRunner(g.pem_file_path)
+        outcome_log = od.OutcomeLogWriter(runner.get_session(outcome_host).open_sftp().open(outcome_log_path, 'ab'))
+    elif outcome_log_path:
+        outcome_log = od.OutcomeLogWriter(open(outcome_log_path, 'ab'))
+
+    start_time = time.time()
+    try:
+        results = await tt.replay_trace(dns_name, entries, speed, max_connections, outcome_log.write if outcome_log else None)
+    finally:
+        if outcome_log is not None:
+            outcome_log.close()
+        if runner is not None:
+            runner.close()
+    total_time = time.time() - start_time
+    tt.print_replay_summary(results)
+    print_fairness_report(results)
+
+    endpoints = {}
+    for path in sorted({result['path'] for result in results}):
+        path_results = [(r['status'], None, r['latency']) for r in results if r['path'] == path]
+        endpoints[path] = summarize_results(path_results, total_time)
+    instance_types = get_cluster_instance_types(aws_clients.get_client('ec2'), {
+        name: get_instance_health(elb_client, get_target_group_arn(name))
+        for name in (g.targer_group_large_name, g.targer_group_micro_name)
+    })
+    bs.save_run(
+        {'mode': 'replay', 'trace': trace_path, 'speed': speed, 'max_connections': max_connections, 'load_balancer_name': g.load_balancer_name},
+        instance_types,
+        endpoints,
+    )
+    return results
+
+
+async def soak(duration, rate, interval=1.0, output_path=None, max_connections=100):
+    """
+    Runs a soak test against both cluster endpoints, streaming one time series point per interval.
+
+    :param duration: Length of the soak test in seconds
+    :param rate: Target requests per second over both endpoints
+    :param interval: Length of a time series interval in seconds
+    :param output_path: A JSON lines file the time series is also appended to
+    :param max_connections: The maximum number of concurrent connections
+    :return: The accumulated per-endpoint totals
+    """
+    elb_client = aws_clients.get_client('elbv2')
+    dns_name = get_load_balancer_dns_name(elb_client)
+    target_groups = {
+        name: get_target_group_arn(name)
+        for name in (g.targer_group_large_name, g.targer_group_micro_name)
+    }
+    print(f"Soak testing for {duration} seconds at {rate} requests per second...")
+
+    totals = await st.run_soak(dns_name, ["/cluster1", "/cluster2"], rate, duration, interval,
+                               elb_client, target_groups, output_path, max_connections)
+
+    instance_types = get_cluster_instance_types(aws_clients.get_client('ec2'), {
+        name: get_instance_health(elb_client, arn) for name, arn in target_groups.items()
+    })
+    bs.save_run(
+        {'mode': 'soak', 'duration': duration, 'rate': rate, 'interval': interval, 'max_connections': max_connections, 'load_balancer_name': g.load_balancer_name},
+        instance_types,
+        {endpoint: dict(total, total_time=duration) for endpoint, total in totals.items()},
+    )
+    return totals
+
+
+async def matrix(num_requests=200, concurrency=50, pool_sizes=cm.DEFAULT_POOL_SIZES, use_https=False):
+    """
+    Runs the same workload under each connection strategy and prints throughput, latency and connection setup cost per strategy.
+
+    :param num_requests: Requests per endpoint and strategy
+    :param concurrency: Requests in flight at a time
+    :param pool_sizes: The keep-alive pool sizes to try
+    :param use_https: Whether to connect over HTTPS, required for the HTTP/2 strategy
+    :return: The summary row of each strategy
+    """
+    elb_client = aws_clients.get_client('elbv2')
+    dns_name = get_load_balancer_dns_name(elb_client)
+    print(f"Running the connection strategy matrix with {num_requests} requests per endpoint, {concurrency} in flight...")
+
+    rows, results = await cm.run_matrix(dns_name, ["/cluster1", "/cluster2"], num_requests, concurrency, pool_sizes, use_https)
+    cm.print_matrix(rows)
+
+    # Each strategy and endpoint is stored as its own endpoint, e.g. 'keep-alive-8 /cluster1'
+    endpoints = {}
+    for row in rows:
+        for endpoint, endpoint_results in results[row['strategy']].items():
+            endpoint_results = [(r['status'], None, r['latency']) for r in endpoint_results]
+            endpoints[f"{row['strategy']} {endpoint}"] = summarize_results(endpoint_results, row['requests'] / row['throughput'] if row['throughput'] else 0.0)
+    bs.save_run(
+        {'mode': 'matrix', 'num_requests': num_requests, 'concurrency': concurrency, 'pool_sizes': list(pool_sizes),
+         'https': use_https, 'strategies': rows, 'load_balancer_name': g.load_balancer_name},
+        {},
+        endpoints,
+    )
+    return rows
+
+
+async def main(record_path=None):
+    num_requests = 1000
+
+    # Initialize the ELB and CloudWatch clients
+    elb_client = aws_clients.get_client('elbv2')
+    cloudwatch_client = aws_clients.get_client('cloudwatch')
+
+    dns_name = get_load_balancer_dns_name(elb_client)
+    recorder = tt.TraceRecorder() if record_path else None
 
     # Define the ARNs for the target groups of cluster1 and cluster2
     target_group_arn_cluster1 = get_target_group_arn(g.targer_group_large_name)
@@ -125,14 +327,14 @@ async def main():
     async with aiohttp.ClientSession() as session:
         # Measure time for /cluster1
         start_time_cluster1 = time.time()
-        tasks_cluster1 = [call_endpoint_http(session, i, "/cluster1", dns_name) for i in range(num_requests)]
-        await asyncio.gather(*tasks_cluster1)
+        tasks_cluster1 = [call_endpoint_http(session, i, "/cluster1", dns_name, recorder) for i in range(num_requests)]
+        results_cluster1 = await asyncio.gather(*tasks_cluster1)
         end_time_cluster1 = time.time()
 
         # Measure time for /cluster2
         start_time_cluster2 = time.time()
-        tasks_cluster2 = [call_endpoint_http(session, i, "/cluster2", dns_name) for i in range(num_requests)]
-        await asyncio.gather(*tasks_cluster2)
+        tasks_cluster2 = [call_endpoint_http(session, i, "/cluster2", dns_name, recorder) for i in range(num_requests)]
+        results_cluster2 = await asyncio.gather(*tasks_cluster2)
         end_time_cluster2 = time.time()
 
     print(f"\nTotal time taken for /cluster1: {end_time_cluster1 - start_time_cluster1:.2f} seconds")
@@ -141,6 +343,54 @@ async def main():
     print(f"\nTotal time taken for /cluster2: {end_time_cluster2 - start_time_cluster2:.2f} seconds")
     print(f"Average time per request for /cluster2: {(end_time_cluster2 - start_time_cluster2) / num_requests:.4f} seconds")
 
+    # Report how the requests were spread over the instances of each cluster
+    print_fairness_report(
+        [to_result("/cluster1", result) for result in results_cluster1] +
+        [to_result("/cluster2", result) for result in results_cluster2]
+    )
+
+    if recorder is not None:
+        recorder.save(record_path)
+
+    # Save a structured record of the run so that it can be compared with benchmark_store.py
+    instance_types = get_cluster_instance_types(aws_clients.get_client('ec2'), {
+        g.targer_group_large_name: instance_health_cluster1,
+        g.targer_group_micro_name: instance_health_cluster2,
+    })
+    bs.save_run(
+        {'mode': 'burst', 'num_requests': num_requests, 'load_balancer_name': g.load_balancer_name},
+        instance_types,
+        {
+            '/cluster1': summarize_results(results_cluster1, end_time_cluster1 - start_time_cluster1),
+            '/cluster2': summarize_results(results_cluster2, end_time_cluster2 - start_time_cluster2),
+        },
+    )
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Benchmark the cluster endpoints of the load balancer.")
+    parser.add_argument('--record', metavar='TRACE', help="save the generated requests as a trace file")
+    parser.add_argument('--replay', metavar='TRACE', help="replay a trace file instead of the synthetic bursts")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed factor, 0 sends without pacing (default: 1.0)")
+    parser.add_argument('--connections', type=int, default=100, help="maximum concurrent connections during replay and soak tests (default: 100)")
+    parser.add_argument('--outcome-log', metavar='FILE', help="append each replay response outcome to an outcome log for outlier detection")
+    parser.add_argument('--outcome-host', metavar='IP', help="write the outcome log on the traffic manager's instance over SFTP")
+    parser.add_argument('--soak', type=float, metavar='SECONDS', help="run a soak test of the given length instead of the synthetic bursts")
+    parser.add_argument('--rate', type=float, default=50.0, help="soak test requests per second over both endpoints (default: 50)")
+    parser.add_argument('--interval', type=float, default=1.0, help="soak test time series interval in seconds (default: 1)")
+    parser.add_argument('--output', metavar='FILE', help="also append the soak test time series to a JSON lines file")
+    parser.add_argument('--matrix', action='store_true', help="compare connection strategies instead of running the synthetic bursts")
+    parser.add_argument('--requests', type=int, default=200, help="matrix requests per endpoint and strategy (default: 200)")
+    parser.add_argument('--concurrency', type=int, default=50, help="matrix requests in flight at a time (default: 50)")
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=cm.DEFAULT_POOL_SIZES, help="matrix keep-alive pool sizes to try")
+    parser.add_argument('--https', action='store_true', help="connect to the load balancer over HTTPS, required for the HTTP/2 strategy")
+    args = parser.parse_args()
+
+    if args.replay:
+        asyncio.run(replay(args.replay, args.speed, args.connections, args.outcome_log, args.outcome_host))
+    elif args.matrix:
+        asyncio.run(matrix(args.requests, args.concurrency, args.pool_sizes, args.https))
+    elif args.soak:
+        asyncio.run(soak(args.soak, args.rate, args.interval, args.output, args.connections))
+    else:
+        asyncio.run(main(args.record))
@@ -0,0 +1,326 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+import globals as g
+
+# Latencies are kept in log-spaced buckets: bucket i covers [MIN_LATENCY * GROWTH^i, MIN_LATENCY * GROWTH^(i+1)).
+# A 1% growth factor keeps every percentile within 1% of the exact value while a run stays a few KB on disk.
+HISTOGRAM_MIN_LATENCY = 1e-5
+HISTOGRAM_GROWTH = 1.01
+DEFAULT_PERCENTILES = [50, 90, 99]
+BOOTSTRAP_RESAMPLES = 1000
+
+'''
+Description: Returns the histogram bucket index of a latency.
+Inputs: latency (float) - The latency in seconds.
+Outputs: index (str) - The bucket index, as a string so that histograms can be saved as JSON.
+'''
+def histogram_bucket(latency: float):
+    return str(max(0, int(math.log(max(latency, HISTOGRAM_MIN_LATENCY) / HISTOGRAM_MIN_LATENCY, HISTOGRAM_GROWTH))))
+
+'''
+Description: Builds a log-bucketed latency histogram from per-request latencies.
+Inputs: latencies (list) - Request latencies in seconds.
+Outputs: histogram (dict) - The bucket parameters and a mapping of bucket index to request count.
+'''
+def build_histogram(latencies: list):
+    counts = {}
+    for latency in latencies:
+        index = histogram_bucket(latency)
+        counts[index] = counts.get(index, 0) + 1
+    return {'min_latency': HISTOGRAM_MIN_LATENCY, 'growth': HISTOGRAM_GROWTH, 'counts': counts}
+
+'''
+Description: Adds the counts of one histogram to another, e.g. to accumulate the histogram of a long run interval by interval.
+Inputs:
+    histogram (dict) - The histogram to add to, modified in place.
+    other (dict) - The histogram to add.
+Outputs: histogram (dict) - The updated histogram.
+'''
+def merge_histograms(histogram: dict, other: dict):
+    for index, count in other['counts'].items():
+        histogram['counts'][index] = histogram['counts'].get(index, 0) + count
+    return histogram
+
+'''
+Description: Returns the buckets of a histogram in ascending order, each represented by its geometric midpoint.
+Inputs: histogram (dict) - A histogram built by build_histogram.
+Outputs: (values, counts) (tuple) - The bucket midpoints in seconds and the request count of each bucket.
+'''
+def histogram_buckets(histogram: dict):
+    min_latency, growth = histogram['min_latency'], histogram['growth']
+    buckets = sorted((int(index), count) for index, count in histogram['counts'].items() if count)
+    return [min_latency * growth ** (index + 0.5) for index, _ in buckets], [count for _, count in buckets]
+
+'''
+Description: Returns the nearest-rank percentile of a sorted list.
+Inputs:
+    sorted_values (list) - Values sorted ascending.
+    pct (float) - The percentile to compute, between 0 and 100.
+Outputs: value (float) - The percentile value, or None for an empty list.
+'''
+def percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+'''
+Description: Returns the nearest-rank percentile of a histogram, as the midpoint of the bucket it falls in.
+Inputs:
+    histogram (dict) - A histogram built by build_histogram.
+    pct (float) - The percentile to compute, between 0 and 100.
+Outputs: value (float) - The percentile value, or None for an empty histogram.
+'''
+def histogram_percentile(histogram: dict, pct: float):
+    values, counts = histogram_buckets(histogram)
+    total = sum(counts)
+    if not total:
+        return None
+    rank = min(max(math.ceil(pct / 100 * total) - 1, 0), total - 1)
+    seen = 0
+    for value, count in zip(values, counts):
+        seen += count
+        if seen > rank:
+            return value
+
+'''
+Description: Returns the git revision of the working tree, with a '-dirty' suffix if there are uncommitted changes.
+Outputs: revision (str) - The revision, or 'unknown' outside a git checkout.
+'''
+def get_git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], stderr=subprocess.DEVNULL, text=True)
+        return revision + ('-dirty' if status.strip() else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+'''
+Description: Looks up the instance type of each instance.
+Inputs:
+    ec2_client (boto3.client) - The EC2 client instance.
+    instance_ids (list) - The instance IDs to look up.
+Outputs: instance_types (dict) - A mapping of instance ID to instance type.
+'''
+def get_instance_types(ec2_client, instance_ids: list):
+    if not instance_ids:
+        return {}
+    response = ec2_client.describe_instances(InstanceIds=list(instance_ids))
+    return {
+        instance['InstanceId']: instance['InstanceType']
+        for reservation in response['Reservations']
+        for instance in reservation['Instances']
+    }
+
+'''
+Description: Builds the per-endpoint summary stored in a run record.
+Inputs:
+    latencies (list) - Latencies in seconds of the successful requests.
+    errors (int) - The number of failed requests.
+    total_time (float) - Wall clock time of the burst in seconds.
+Outputs: endpoint_record (dict) - The summary, including the latency histogram.
+'''
+def summarize_endpoint(latencies: list, errors: int, total_time: float):
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'total_time': total_time,
+        'histogram': build_histogram(latencies),
+    }
+
+'''
+Description: Saves a benchmark run as a JSON record in the benchmark runs folder.
+Inputs:
+    config (dict) - The benchmark configuration (mode, request counts, load balancer name, ...).
+    instance_types (dict) - A mapping of target group name to {instance ID: instance type}.
+    endpoints (dict) - A mapping of endpoint path to the summary returned by summarize_endpoint.
+    runs_folder (str) - The folder to save the record in.
+Outputs: record_path (str) - The path of the saved record.
+'''
+def save_run(config: dict, instance_types: dict, endpoints: dict, runs_folder: str = g.benchmark_runs_folder):
+    created = datetime.now(timezone.utc)
+    git_revision = get_git_revision()
+    run_id = f"{created.strftime('%Y%m%dT%H%M%SZ')}-{git_revision}"
+    suffix = 1
+    while os.path.exists(os.path.join(runs_folder, f"{run_id}.json")):
+        suffix += 1
+        run_id = f"{created.strftime('%Y%m%dT%H%M%SZ')}-{git_revision}-{suffix}"
+    record = {
+        'run_id': run_id,
+        'created': created.isoformat(),
+        'git_revision': git_revision,
+        'config': config,
+        'instance_types': instance_types,
+        'endpoints': endpoints,
+    }
+
+    os.makedirs(runs_folder, exist_ok=True)
+    record_path = os.path.join(runs_folder, f"{run_id}.json")
+    with open(record_path, 'w') as file:
+        json.dump(record, file, indent=2)
+    print(f"Saved benchmark run {run_id} to {record_path}")
+    return record_path
+
+'''
+Description: Loads a run record by path or by run ID.
+Inputs:
+    run (str) - A record path or a run ID saved in runs_folder.
+    runs_folder (str) - The folder run IDs are looked up in.
+Outputs: record (dict) - The run record.
+'''
+def load_run(run: str, runs_folder: str = g.benchmark_runs_folder):
+    record_path = run if os.path.exists(run) else os.path.join(runs_folder, f"{run}.json")
+    with open(record_path, 'r') as file:
+        return json.load(file)
+
+'''
+Description: Lists the saved run records, oldest first.
+Inputs: runs_folder (str) - The folder containing the run records.
+Outputs: run_ids (list) - The IDs of the saved runs.
+'''
+def list_runs(runs_folder: str = g.benchmark_runs_folder):
+    if not os.path.isdir(runs_folder):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(runs_folder) if name.endswith('.json'))
+
+'''
+Description: Computes the nearest-rank percentiles of many resampled histograms at once.
+Inputs:
+    values (numpy.ndarray) - The bucket midpoints, ascending.
+    samples (numpy.ndarray) - A resamples x buckets matrix of bucket counts.
+    pct (float) - The percentile to compute.
+Outputs: percentiles (numpy.ndarray) - The percentile of each resample.
+'''
+def _resampled_percentiles(values, samples, pct: float):
+    import numpy as np
+
+    cumulative = samples.cumsum(axis=1)
+    total = cumulative[:, -1]
+    rank = np.clip(np.ceil(pct / 100 * total) - 1, 0, total - 1)
+    # The value at a rank is the first bucket whose cumulative count exceeds it
+    return values[(cumulative > rank[:, None]).argmax(axis=1)]
+
+'''
+Description: Computes bootstrap confidence intervals for the relative change of percentiles between two latency histograms.
+             Resampling a histogram's requests is a multinomial draw over its buckets, so the cost depends on the number of
+             buckets rather than requests, and one set of resamples serves every percentile.
+Inputs:
+    baseline (dict) - The baseline histogram.
+    candidate (dict) - The candidate histogram.
+    percentiles (list) - The percentiles to compare.
+    confidence (float) - The confidence level of the intervals, e.g. 0.95.
+    resamples (int) - The number of bootstrap resamples.
+Outputs: intervals (dict) - A mapping of percentile to the (low, high) bounds of its relative change, in percent.
+'''
+def bootstrap_delta_intervals(baseline: dict, candidate: dict, percentiles: list, confidence: float = 0.95, resamples: int = BOOTSTRAP_RESAMPLES):
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    resampled = []
+    for histogram in (baseline, candidate):
+        values, counts = histogram_buckets(histogram)
+        counts = np.array(counts)
+        resampled.append((np.array(values), rng.multinomial(counts.sum(), counts / counts.sum(), size=resamples)))
+
+    intervals = {}
+    tail = (1 - confidence) / 2 * 100
+    for pct in percentiles:
+        base_values = _resampled_percentiles(*resampled[0], pct)
+        candidate_values = _resampled_percentiles(*resampled[1], pct)
+        deltas = sorted(((candidate_values - base_values) / base_values * 100).tolist())
+        intervals[pct] = (percentile(deltas, tail), percentile(deltas, 100 - tail))
+    return intervals
+
+'''
+Description: Compares candidate runs against a baseline run, endpoint by endpoint and percentile by percentile.
+             A percentile regresses when the whole confidence interval of its change lies above the threshold,
+             and improves when the whole interval lies below minus the threshold.
+Inputs:
+    baseline (dict) - The baseline run record.
+    candidates (list) - The run records to compare against the baseline.
+    percentiles (list) - The percentiles to compare.
+    threshold (float) - The allowed slowdown in percent.
+    confidence (float) - The confidence level of the bootstrap intervals.
+Outputs: rows (list) - One dict per (candidate, endpoint, percentile) comparison with the values, delta, interval and verdict.
+'''
+def compare_runs(baseline: dict, candidates: list, percentiles: list = DEFAULT_PERCENTILES, threshold: float = 5.0, confidence: float = 0.95):
+    rows = []
+    for candidate in candidates:
+        for endpoint, base_summary in baseline['endpoints'].items():
+            if endpoint not in candidate['endpoints']:
+                print(f"Run {candidate['run_id']} has no results for {endpoint}, skipping")
+                continue
+            base_histogram = base_summary['histogram']
+            candidate_histogram = candidate['endpoints'][endpoint]['histogram']
+            if not any(base_histogram['counts'].values()) or not any(candidate_histogram['counts'].values()):
+                continue
+
+            intervals = bootstrap_delta_intervals(base_histogram, candidate_histogram, percentiles, confidence)
+            for pct in percentiles:
+                base_value = histogram_percentile(base_histogram, pct)
+                candidate_value = histogram_percentile(candidate_histogram, pct)
+                low, high = intervals[pct]
+                if low > threshold:
+                    verdict = 'FAIL'
+                elif high < -threshold:
+                    verdict = 'improved'
+                else:
+                    verdict = 'ok'
+                rows.append({
+                    'run_id': candidate['run_id'],
+                    'endpoint': endpoint,
+                    'percentile': pct,
+                    'baseline': base_value,
+                    'candidate': candidate_value,
+                    'delta': (candidate_value - base_value) / base_value * 100,
+                    'interval': (low, high),
+                    'verdict': verdict,
+                })
+    return rows
+
+'''
+Description: Prints the comparison rows returned by compare_runs as a table.
+Inputs:
+    baseline (dict) - The baseline run record.
+    rows (list) - The comparison rows.
+'''
+def print_comparison(baseline: dict, rows: list):
+    print(f"Baseline: {baseline['run_id']}")
+    print(f"{'run':<34} {'endpoint':<10} {'pct':>4} {'baseline':>10} {'candidate':>10} {'delta':>8} {'interval':>20}  verdict")
+    for row in rows:
+        low, high = row['interval']
+        print(f"{row['run_id']:<34} {row['endpoint']:<10} {'p' + format(row['percentile'], 'g'):>4} "
+              f"{row['baseline'] * 1000:>8.2f}ms {row['candidate'] * 1000:>8.2f}ms {row['delta']:>+7.1f}% "
+              f"{f'[{low:+.1f}%, {high:+.1f}%]':>20}  {row['verdict']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List and compare saved benchmark runs.")
+    parser.add_argument('--runs-folder', default=g.benchmark_runs_folder, help="folder containing the run records")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="list saved runs")
+
+    compare_parser = subparsers.add_parser('compare', help="compare runs against the first one")
+    compare_parser.add_argument('runs', nargs='+', help="run IDs or record paths; the first one is the baseline")
+    compare_parser.add_argument('--percentiles', type=float, nargs='+', default=DEFAULT_PERCENTILES, help="percentiles to compare")
+    compare_parser.add_argument('--threshold', type=float, default=5.0, help="allowed slowdown in percent (default: 5)")
+    compare_parser.add_argument('--confidence', type=float, default=0.95, help="bootstrap confidence level (default: 0.95)")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for run_id in list_runs(args.runs_folder):
+            print(run_id)
+    else:
+        if len(args.runs) < 2:
+            parser.error("compare needs a baseline and at least one other run")
+        records = [load_run(run, args.runs_folder) for run in args.runs]
+        rows = compare_runs(records[0], records[1:], args.percentiles, args.threshold, args.confidence)
+        print_comparison(records[0], rows)
+        # Non-zero exit status so that scripts can gate on regressions
+        sys.exit(1 if any(row['verdict'] == 'FAIL' for row in rows) else 0)
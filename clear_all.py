@@ -1,4 +1,6 @@
-import boto3
+import aws_clients
+import globals as g
+import instance_inventory as ii
 
 
 # Define the security group name and key name
@@ -10,7 +12,7 @@ Description: Terminates all running EC2 instances and returns their instance IDs
 Outputs: instance_ids (list) - A list of terminated instance IDs.
 '''
 def terminate_instances():
-    ec2 = boto3.client('ec2')
+    ec2 = aws_clients.get_client('ec2')
     response = ec2.describe_instances(
         Filters=[
             {'Name': 'instance-state-name', 'Values': ['running']}
@@ -29,7 +31,7 @@ Description: Waits for the specified EC2 instances to fully terminate before pro
 Inputs: instance_ids (list) - A list of EC2 instance IDs to wait for termination.
 '''
 def wait_for_termination(instance_ids: list):
-    ec2 = boto3.client('ec2')
+    ec2 = aws_clients.get_client('ec2')
     print('Waiting for instances to terminate.')
     waiter = ec2.get_waiter('instance_terminated')
     waiter.wait(InstanceIds=instance_ids)
@@ -39,7 +41,7 @@ def wait_for_termination(instance_ids: list):
 Description: Deletes the specified key pair if it exists in the AWS account.
 '''
 def delete_key_pairs():
-    ec2 = boto3.client('ec2')
+    ec2 = aws_clients.get_client('ec2')
     response = ec2.describe_key_pairs()
     for key_pair in response['KeyPairs']:
         if key_pair['KeyName'] == key_name:
@@ -50,7 +52,7 @@ def delete_key_pairs():
 Description: Deletes the specified security group by its name if it exists in the AWS account.
 '''
 def delete_security_group():
-    ec2 = boto3.client('ec2')
+    ec2 = aws_clients.get_client('ec2')
     
     # Describe the security group to get its ID
     response = ec2.describe_security_groups(
@@ -72,7 +74,7 @@ def delete_security_group():
 Description: Deletes all load balancers, along with their associated listeners, rules, and target groups.
 '''
 def delete_load_balancers():
-    elb = boto3.client('elbv2')
+    elb = aws_clients.get_client('elbv2')
     response = elb.describe_load_balancers()
     
     for lb in response['LoadBalancers']:
@@ -109,7 +111,7 @@ def delete_load_balancers():
 Description: Deletes all target groups in the AWS account.
 '''
 def delete_target_groups():
-    elb = boto3.client('elbv2')
+    elb = aws_clients.get_client('elbv2')
     target_groups = elb.describe_target_groups()
     for tg in target_groups['TargetGroups']:
         elb.delete_target_group(TargetGroupArn=tg['TargetGroupArn'])
@@ -125,6 +127,7 @@ def main():
     delete_target_groups()
     delete_key_pairs()
     delete_security_group()
+    ii.delete_event_queue(aws_clients.get_client('sqs'), aws_clients.get_client('events'), g.instance_events_queue_name)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import time
+import aiohttp
+import benchmark_store as bs
+import traffic_trace as tt
+
+# HTTP/2 needs httpx with the h2 extra (pip install 'httpx[http2]'); the matrix skips it without them
+try:
+    import httpx
+    import h2  # noqa: F401
+except ImportError:
+    httpx = None
+
+DEFAULT_POOL_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+'''
+Description: Connection accounting of one strategy run: connections opened, their setup time and reused connections.
+'''
+class ConnectionStats:
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.setup_times = []
+        self.phase_started = None
+
+    '''
+    Description: Returns an aiohttp TraceConfig that records connection creation and reuse into these stats.
+    '''
+    def trace_config(self):
+        async def on_create_start(session, context, params):
+            context.connect_started = time.monotonic()
+
+        async def on_create_end(session, context, params):
+            self.created += 1
+            self.setup_times.append(time.monotonic() - context.connect_started)
+
+        async def on_reuse(session, context, params):
+            self.reused += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+    '''
+    Description: Records httpcore trace events (HTTP/2 strategy): the TCP connect and TLS handshake of each new connection.
+    Inputs:
+        event_name (str) - The httpcore event, e.g. 'connection.connect_tcp.started'.
+        info (dict) - The event details.
+    '''
+    async def httpcore_trace(self, event_name: str, info: dict):
+        # Connections of the HTTP/2 strategy are opened one after the other, so phases do not interleave
+        if event_name == 'connection.connect_tcp.started':
+            self.created += 1
+            self.setup_times.append(0.0)
+        if event_name in ('connection.connect_tcp.started', 'connection.start_tls.started'):
+            self.phase_started = time.monotonic()
+        elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete') and self.setup_times:
+            self.setup_times[-1] += time.monotonic() - self.phase_started
+
+async def _timed_request(send, url: str, semaphore, results: list):
+    async with semaphore:
+        sent_at = time.monotonic()
+        try:
+            status_code, response_json, protocol = await send(url)
+            backend_id = tt.get_backend_id(response_json)
+        except Exception as e:
+            print(f"Request to {url} failed - {str(e)}")
+            status_code, backend_id, protocol = None, None, None
+        results.append({'status': status_code, 'backend': backend_id, 'latency': time.monotonic() - sent_at, 'protocol': protocol})
+
+async def _run_workload(send, base_url: str, endpoints: list, num_requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+    for endpoint in endpoints:
+        results[endpoint] = []
+        await asyncio.gather(*[_timed_request(send, f"{base_url}{endpoint}", semaphore, results[endpoint]) for _ in range(num_requests)])
+    return results
+
+'''
+Description: Runs the workload with aiohttp under one connection strategy.
+Inputs:
+    base_url (str) - The scheme and host of the load balancer, e.g. 'http://my-alb.amazonaws.com'.
+    endpoints (list) - The paths to request.
+    num_requests (int) - Requests per endpoint.
+    concurrency (int) - Requests in flight at a time.
+    pool_size (int) - The maximum number of pooled keep-alive connections, or None to open a new connection per request.
+Outputs: (results, stats, elapsed) (tuple) - The per-endpoint request results, the ConnectionStats and the wall clock time.
+'''
+async def run_aiohttp_strategy(base_url: str, endpoints: list, num_requests: int, concurrency: int, pool_size: int = None):
+    stats = ConnectionStats()
+    if pool_size is None:
+        connector = aiohttp.TCPConnector(force_close=True, limit=concurrency)
+    else:
+        connector = aiohttp.TCPConnector(limit=pool_size)
+
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[stats.trace_config()]) as session:
+        async def send(url):
+            async with session.get(url, headers={'content-type': 'application/json'}) as response:
+                return response.status, await response.json(), f"HTTP/{response.version.major}.{response.version.minor}"
+
+        start_time = time.monotonic()
+        results = await _run_workload(send, base_url, endpoints, num_requests, concurrency)
+        return results, stats, time.monotonic() - start_time
+
+'''
+Description: Runs the workload with httpx over HTTP/2, multiplexing the requests over as few connections as possible.
+             Load balancers only negotiate HTTP/2 over TLS, so base_url must be https.
+Inputs: same as run_aiohttp_strategy, without the pool size.
+Outputs: (results, stats, elapsed) (tuple) - The per-endpoint request results, the ConnectionStats and the wall clock time.
+'''
+async def run_http2_strategy(base_url: str, endpoints: list, num_requests: int, concurrency: int):
+    stats = ConnectionStats()
+    async with httpx.AsyncClient(http2=True, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def send(url):
+            response = await client.get(url, headers={'content-type': 'application/json'}, extensions={'trace': stats.httpcore_trace})
+            return response.status_code, response.json(), response.http_version
+
+        start_time = time.monotonic()
+        results = await _run_workload(send, base_url, endpoints, num_requests, concurrency)
+        return results, stats, time.monotonic() - start_time
+
+'''
+Description: Summarizes the run of one strategy.
+Inputs:
+    strategy (str) - The strategy name.
+    results (dict) - The per-endpoint request results.
+    stats (ConnectionStats) - The connection accounting of the run.
+    elapsed (float) - The wall clock time of the run in seconds.
+Outputs: row (dict) - Throughput, latency percentiles, error count and connection setup cost of the strategy.
+'''
+def summarize_strategy(strategy: str, results: dict, stats: ConnectionStats, elapsed: float):
+    all_results = [result for endpoint_results in results.values() for result in endpoint_results]
+    latencies = sorted(result['latency'] for result in all_results if result['status'] == 200)
+    protocols = {}
+    for result in all_results:
+        if result['protocol']:
+            protocols[result['protocol']] = protocols.get(result['protocol'], 0) + 1
+    return {
+        'strategy': strategy,
+        'requests': len(all_results),
+        'errors': len(all_results) - len(latencies),
+        'throughput': len(all_results) / elapsed if elapsed else 0.0,
+        'p50': bs.percentile(latencies, 50),
+        'p99': bs.percentile(latencies, 99),
+        'connections': stats.created,
+        'reused': stats.reused,
+        'setup_mean': sum(stats.setup_times) / len(stats.setup_times) if stats.setup_times else 0.0,
+        # Setup time summed over connections, relative to the run's total request time: the share of latency spent connecting
+        'setup_share': sum(stats.setup_times) / sum(latencies) if latencies else 0.0,
+        'protocols': protocols,
+    }
+
+'''
+Description: Runs the same workload under every connection strategy: a new connection per request, keep-alive pools of each
+             size, and HTTP/2 multiplexing when available.
+Inputs:
+    dns_name (str) - The DNS name of the load balancer.
+    endpoints (list) - The paths to request.
+    num_requests (int) - Requests per endpoint and strategy.
+    concurrency (int) - Requests in flight at a time.
+    pool_sizes (list) - The keep-alive pool sizes to try.
+    use_https (bool) - Whether to connect over HTTPS; required for HTTP/2.
+Outputs: (rows, results) (tuple) - The summary row of each strategy, and its per-endpoint request results keyed by strategy.
+'''
+async def run_matrix(dns_name: str, endpoints: list, num_requests: int = 200, concurrency: int = 50,
+                     pool_sizes: list = DEFAULT_POOL_SIZES, use_https: bool = False):
+    base_url = f"{'https' if use_https else 'http'}://{dns_name}"
+    strategies = [('new-connection', None)] + [(f'keep-alive-{size}', size) for size in pool_sizes]
+
+    rows = []
+    all_results = {}
+    for strategy, pool_size in strategies:
+        print(f"Running strategy {strategy}...")
+        results, stats, elapsed = await run_aiohttp_strategy(base_url, endpoints, num_requests, concurrency, pool_size)
+        rows.append(summarize_strategy(strategy, results, stats, elapsed))
+        all_results[strategy] = results
+
+    if httpx is None:
+        print("Skipping strategy http2: install 'httpx[http2]' to enable it")
+    elif not use_https:
+        print("Skipping strategy http2: the load balancer only negotiates HTTP/2 over an HTTPS listener")
+    else:
+        print("Running strategy http2...")
+        results, stats, elapsed = await run_http2_strategy(base_url, endpoints, num_requests, concurrency)
+        rows.append(summarize_strategy('http2', results, stats, elapsed))
+        all_results['http2'] = results
+    return rows, all_results
+
+'''
+Description: Prints the strategy summary rows as a table.
+Inputs: rows (list) - The rows returned by run_matrix.
+'''
+def print_matrix(rows: list):
+    print(f"\n{'strategy':<16} {'req/s':>8} {'p50':>9} {'p99':>9} {'errors':>6} {'conns':>6} {'reused':>7} {'setup':>9} {'setup%':>7}  protocols")
+    for row in rows:
+        p50 = f"{row['p50'] * 1000:.2f}ms" if row['p50'] is not None else '-'
+        p99 = f"{row['p99'] * 1000:.2f}ms" if row['p99'] is not None else '-'
+        protocols = ', '.join(f"{protocol}: {count}" for protocol, count in row['protocols'].items())
+        print(f"{row['strategy']:<16} {row['throughput']:>8.1f} {p50:>9} {p99:>9} {row['errors']:>6} {row['connections']:>6} "
+              f"{row['reused']:>7} {row['setup_mean'] * 1000:>7.2f}ms {row['setup_share']:>7.1%}  {protocols}")
@@ -1,4 +1,5 @@
 import boto3
+import aws_clients
 import globals as g
 
 #IMPORTANT
@@ -6,14 +7,14 @@ import globals as g
 # cluster2: contains t2.micro instances
 
 '''
-Description: Initializes and returns clients for EC2 and Elastic Load Balancing (ELB) services using Boto3.
+Description: Returns the shared clients for EC2 and Elastic Load Balancing (ELB) services.
 Outputs: 
     ec2_client (boto3.client) - The EC2 client instance.
     elb_client (boto3.client) - The ELB client instance.
 '''
 def initialize_clients():
-    ec2_client = boto3.client('ec2')
-    elb_client = boto3.client('elbv2')
+    ec2_client = aws_clients.get_client('ec2')
+    elb_client = aws_clients.get_client('elbv2')
     return ec2_client, elb_client
 
 '''
@@ -135,6 +136,21 @@ def create_target_groups(elb_client: boto3.client, vpc_id: str):
 
     return target_group_arn_micro, target_group_arn_large
 
+'''
+Description: Enables or disables cross-zone load balancing on target groups. With it disabled, each load balancer node only
+             forwards to targets in its own availability zone, which zone-aware routing relies on.
+Inputs: 
+    elb_client (boto3.client) - The ELB client instance to make the request.
+    target_group_arns (list) - The ARNs of the target groups to configure.
+    enabled (bool) - Whether cross-zone load balancing is enabled.
+'''
+def configure_cross_zone(elb_client: boto3.client, target_group_arns: list, enabled: bool):
+    for target_group_arn in target_group_arns:
+        elb_client.modify_target_group_attributes(
+            TargetGroupArn=target_group_arn,
+            Attributes=[{'Key': 'load_balancing.cross_zone.enabled', 'Value': 'true' if enabled else 'false'}]
+        )
+
 '''
 Description: Registers t2.micro and t2.large EC2 instances to their respective target groups.
 Inputs: 
@@ -211,6 +227,10 @@ def main():
         print(f'Target Group ARN (t2.micro): {target_group_arn_micro}')
         print(f'Target Group ARN (t2.large): {target_group_arn_large}')
 
+        if g.zone_aware_routing:
+            configure_cross_zone(elb_client, [target_group_arn_micro, target_group_arn_large], False)
+            print('Cross-zone load balancing disabled for zone-aware routing')
+
         register_instances(elb_client, target_group_arn_micro, target_group_arn_large, t2_micro_instances, t2_large_instances)
         create_listener_and_routes(elb_client, load_balancer_arn, target_group_arn_micro, target_group_arn_large)
 
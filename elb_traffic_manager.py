@@ -1,32 +1,40 @@
-import boto3
+import os
 import requests
 import time
+from botocore.exceptions import ClientError
+import aws_api_budget as budget
+import aws_clients
+import globals as g
+import instance_inventory as ii
+import outlier_detection as od
+import probe_history as ph
 
-# Initialize boto3 clients
-ec2_client = boto3.client('ec2')
-elb_client = boto3.client('elbv2')
+# Shared boto3 clients, reused by every iteration of the control loop
+ec2_client = aws_clients.get_client('ec2')
+elb_client = aws_clients.get_client('elbv2')
+
+# Error codes AWS returns when the account's API rate limit is exceeded
+THROTTLING_ERROR_CODES = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException')
 
 '''
 Description: Retrieves the Amazon Resource Name (ARN) of a specified target group.
+             ARNs never change, so each name is only looked up once.
 Inputs: target_group_name (str) - The name of the target group to retrieve the ARN for.
 Outputs: target_group_arn (str) - The ARN of the specified target group.
 '''
+@budget.memoize
 def get_target_group_arn(target_group_name: str):
     response = elb_client.describe_target_groups(Names=[target_group_name])
     return response['TargetGroups'][0]['TargetGroupArn']
 
-import boto3
-
 '''
 Description: Retrieves the IDs of running EC2 instances of a specified instance type.
 Inputs: instance_type (str) - The type of instances to filter by (e.g., 't2.micro').
 Outputs: instances (list) - A list of instance IDs for the running instances of the specified type.
 '''
 def get_instances_from_cluster(instance_type: str):
-    ec2 = boto3.client('ec2')
-    
     # Use filters to get instances of a specific instance type and only running instances
-    response = ec2.describe_instances(
+    response = ec2_client.describe_instances(
         Filters=[
             {
                 'Name': 'instance-type',
@@ -49,13 +57,16 @@ def get_instances_from_cluster(instance_type: str):
 
 '''
 Description: Measures the response time for an EC2 instance by sending an HTTP request to port 8000.
-Inputs: instance_id (str) - The ID of the EC2 instance to measure the response time for.
+Inputs: 
+    instance_id (str) - The ID of the EC2 instance to measure the response time for.
+    public_ip (str) - The public IP address of the instance, looked up with describe_instances if not given.
 Outputs: response_time (float) - The time taken to receive a response in seconds, or infinity if the request fails.
 '''
-def measure_response_time(instance_id: str):
+def measure_response_time(instance_id: str, public_ip: str = None):
     print(f"Measuring response time for instance {instance_id}...")
-    instance = ec2_client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
-    public_ip = instance['PublicIpAddress']
+    if public_ip is None:
+        instance = ec2_client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+        public_ip = instance['PublicIpAddress']
     print(f"Public IP: {public_ip}")
 
     start_time = time.time()
@@ -68,89 +79,239 @@ def measure_response_time(instance_id: str):
         print("Request failed\n")
         return float('inf')
 
+'''
+Description: Probes the available instances of a cluster and records the outcomes for outlier detection.
+Inputs: 
+    instances (list) - A list of EC2 instance IDs to probe.
+    inventory (InstanceInventory) - The inventory the public IPs are taken from, or None to look them up.
+    detector (OutlierDetector) - Skips ejected instances and records the probe outcomes, or None to probe every instance.
+Outputs: response_times (dict) - A mapping of probed instance ID to response time, infinity for failed probes.
+'''
+def probe_instances(instances: list, inventory=None, detector=None):
+    if detector is not None:
+        instances = detector.filter_available(instances)
+        print(f"Available instances: {instances}")
+
+    response_times = {}
+    for instance in instances:
+        public_ip = inventory.get_public_ip(instance) if inventory is not None else None
+        response_times[instance] = measure_response_time(instance, public_ip)
+        if detector is not None:
+            detector.record(instance, response_times[instance] != float('inf'), active=True)
+    return response_times
+
 '''
 Description: Identifies the EC2 instance with the lowest response time from a list of instances.
-Inputs: instances (list) - A list of EC2 instance IDs to evaluate.
-Outputs: best_instance (str) - The ID of the instance with the lowest response time.
+Inputs: 
+    instances (list) - A list of EC2 instance IDs to evaluate.
+    inventory (InstanceInventory) - The inventory the public IPs are taken from, or None to look them up.
+    detector (OutlierDetector) - Skips ejected instances and records the probe outcomes, or None to probe every instance.
+    history (ProbeHistory) - Records the probe samples and the decision, or None.
+Outputs: best_instance (str) - The ID of the instance with the lowest response time, or None if no instance responded.
 '''
-def find_lowest_response_time_instance(instances: list):
+def find_lowest_response_time_instance(instances: list, inventory=None, detector=None, history=None):
     lowest_response_time = float('inf')
     best_instance = None
 
     print("\nFinding the best isntance...")
     print(f"Instances: {instances}")
     
-    for instance in instances:
-        response_time = measure_response_time(instance)
+    response_times = probe_instances(instances, inventory, detector)
+    for instance, response_time in response_times.items():
         if response_time < lowest_response_time:
             lowest_response_time = response_time
             best_instance = instance
     
+    if history is not None:
+        history.record_round(response_times, [best_instance] if best_instance else [])
     print(f"Best instance: {best_instance}")
     return best_instance
 
 '''
-Description: Updates an Elastic Load Balancer (ELB) target group by deregistering all instances except the specified target instance and registering it.
+Description: Identifies the instance with the lowest response time in each availability zone, so that every load balancer node
+             can forward to a backend in its own zone. A zone spills over to the other zones (gets no target) when its best
+             response time exceeds `spill_latency_factor` times the best overall, or when less than `min_zone_capacity` of its
+             instances are available. The overall best instance is always kept.
+Inputs: 
+    instances (list) - A list of EC2 instance IDs to evaluate.
+    inventory (InstanceInventory) - The inventory the public IPs and availability zones are taken from.
+    detector (OutlierDetector) - Skips ejected instances and records the probe outcomes, or None to probe every instance.
+    spill_latency_factor (float) - How much slower than the best zone a zone may be before it spills over.
+    min_zone_capacity (float) - The fraction of a zone's instances that must be available.
+    history (ProbeHistory) - Records the probe samples and the decision, or None.
+Outputs: best_instances (list) - The IDs of the selected instances, one per zone that keeps its traffic.
+'''
+def find_zone_aware_instances(instances: list, inventory, detector=None, spill_latency_factor: float = 2.0, min_zone_capacity: float = 0.5, history=None):
+    print("\nFinding the best instance of each zone...")
+    print(f"Instances: {instances}")
+
+    response_times = probe_instances(instances, inventory, detector)
+
+    zone_sizes = {}
+    for instance in instances:
+        zone = inventory.get_zone(instance)
+        zone_sizes[zone] = zone_sizes.get(zone, 0) + 1
+
+    zone_best = {}
+    zone_available = {}
+    for instance, response_time in response_times.items():
+        if response_time == float('inf'):
+            continue
+        zone = inventory.get_zone(instance)
+        zone_available[zone] = zone_available.get(zone, 0) + 1
+        if zone not in zone_best or response_time < response_times[zone_best[zone]]:
+            zone_best[zone] = instance
+
+    if not zone_best:
+        print("No instance responded")
+        if history is not None:
+            history.record_round(response_times, [])
+        return []
+
+    overall_best = min(zone_best.values(), key=response_times.get)
+    best_instances = []
+    for zone, instance in sorted(zone_best.items(), key=lambda item: str(item[0])):
+        if response_times[instance] > spill_latency_factor * response_times[overall_best]:
+            print(f"Zone {zone} spills over: best response time {response_times[instance]:.4f}s is too slow")
+        elif zone_available[zone] < min_zone_capacity * zone_sizes[zone]:
+            print(f"Zone {zone} spills over: only {zone_available[zone]} of {zone_sizes[zone]} instances available")
+        else:
+            best_instances.append(instance)
+    if overall_best not in best_instances:
+        best_instances.append(overall_best)
+
+    if history is not None:
+        history.record_round(response_times, best_instances)
+    print(f"Best instances: {best_instances}")
+    return best_instances
+
+'''
+Description: Updates an Elastic Load Balancer (ELB) target group by deregistering all instances except the specified target instances and registering them.
+             Nothing is changed when there is no target instance.
 Inputs: 
     target_group_arn (str) - The ARN of the target group to update.
-    target_instance_id (str) - The ID of the instance to register to the target group.
-    instance_type (str) - The type of instances to retrieve for deregistration.
+    target_instance_ids (list) - The IDs of the instances to register to the target group.
+    instances (list) - The instances of the cluster, all deregistered except the target instances.
+    batcher (RegistrationBatcher) - Queues the changes to be sent by its next flush, or None to send them right away.
 '''
-def update_elb_target(target_group_arn: str, target_instance_id: str, instance_type: str):
+def update_elb_target(target_group_arn: str, target_instance_ids: list, instances: list, batcher=None):
+    # Without a responsive instance (e.g. the manager's own network failed this round), keep serving from the current targets
+    if not target_instance_ids:
+        print(f"No responsive instance for target group {target_group_arn}, keeping its current targets")
+        return
+
     # Print the ARN of the target group being updated
     print(f"Updating target group with ARN: {target_group_arn}")
-    print(f"Registering instance {target_instance_id} to the target group...")
-
-    instances = get_instances_from_cluster(instance_type)
+    print(f"Registering instances {target_instance_ids} to the target group...")
     
-    # Filter out the target instance from the list of registered targets
+    # Filter out the target instances from the list of registered targets
     targets_to_deregister = [
         instance_id for instance_id in instances
-        if instance_id != target_instance_id
+        if instance_id not in target_instance_ids
     ]
 
     print(f"Targets to deregister: {targets_to_deregister}")
 
-    # Deregister all other instances except the target instance
-    if targets_to_deregister:
-        elb_client.deregister_targets(
+    if batcher is not None:
+        batcher.queue(target_group_arn, target_instance_ids, targets_to_deregister)
+        return
+
+    # Register the new target instances to the specific target group, first so that the group is never left without a target
+    if target_instance_ids:
+        elb_client.register_targets(
             TargetGroupArn=target_group_arn,
-            Targets=[{'Id': instance_id} for instance_id in targets_to_deregister]
+            Targets=[{'Id': instance_id} for instance_id in target_instance_ids]
         )
 
-
-    # Register the new target instance to the specific target group
-        elb_client.register_targets(
+    # Deregister all other instances except the target instances
+    if targets_to_deregister:
+        elb_client.deregister_targets(
             TargetGroupArn=target_group_arn,
-            Targets=[{'Id': target_instance_id}]
+            Targets=[{'Id': instance_id} for instance_id in targets_to_deregister]
         )
     
     # Confirm action
-    print(f"Successfully registered instance {target_instance_id} to target group {target_group_arn}.")
+    print(f"Successfully registered instances {target_instance_ids} to target group {target_group_arn}.")
 
 # Main function
 def main():
+    # Cluster membership comes from instance state-change events, with a full reconcile every few minutes
+    event_queue = ii.open_event_queue(aws_clients.get_client('sqs'), g.instance_events_queue_name)
+    inventory = ii.InstanceInventory(ec2_client, event_queue, g.inventory_reconcile_interval)
+
+    # Failing instances are ejected from selection; ejection times are counted in probe intervals
+    detector = od.OutlierDetector(base_ejection_time=10 * g.probe_interval, max_ejection_time=600 * g.probe_interval)
+
+    # Response outcomes are read as they are appended (not the backlog from before the start), and failed responses are charged
+    # to the target registered for their cluster while they were sent
+    outcome_log_offset = os.path.getsize(g.outcome_log_path) if g.outcome_log_path and os.path.exists(g.outcome_log_path) else 0
+    outcome_log_read = time.monotonic()
+    target_history = od.TargetHistory()
+
+    # Every probe sample and routing decision is kept for post-incident analysis with probe_history.py
+    history = ph.ProbeHistory(g.probe_history_path, g.probe_history_capacity)
+
+    # Registration changes of both clusters are sent together, and only when the targets change
+    batcher = budget.RegistrationBatcher(elb_client, g.registration_resync_interval)
+    throttled_delay = g.probe_interval
+
     while True:  # Infinite loop to keep running the logic
         try:
+            # Both clusters' probe rounds are recorded with the timestamp of this iteration
+            history.begin_round()
+
             # Get instances for each cluster
-            cluster1_instances = get_instances_from_cluster('t2.large') # cluster1
-            cluster2_instances = get_instances_from_cluster('t2.micro') # cluster2
+            inventory.refresh()
+            cluster1_instances = inventory.get_instances('t2.large') # cluster1
+            cluster2_instances = inventory.get_instances('t2.micro') # cluster2
 
-            # Find the best instance for each cluster
-            best_instance_cluster1 = find_lowest_response_time_instance(cluster1_instances)
-            best_instance_cluster2 = find_lowest_response_time_instance(cluster2_instances)
+            # Add the response outcomes seen by benchmarks or proxies since the last iteration
+            if g.outcome_log_path:
+                read_at = time.monotonic()
+                outcomes, outcome_log_offset = od.read_outcome_log(g.outcome_log_path, outcome_log_offset)
+                detector.record_results(outcomes, target_history, outcome_log_read - g.outcome_delay)
+                outcome_log_read = read_at
+
+            # Find the best instance for each cluster, or for each zone of each cluster
+            if g.zone_aware_routing:
+                best_instances_cluster1 = find_zone_aware_instances(cluster1_instances, inventory, detector, g.zone_spill_latency_factor, g.zone_min_capacity, history)
+                best_instances_cluster2 = find_zone_aware_instances(cluster2_instances, inventory, detector, g.zone_spill_latency_factor, g.zone_min_capacity, history)
+            else:
+                best_instance_cluster1 = find_lowest_response_time_instance(cluster1_instances, inventory, detector, history)
+                best_instance_cluster2 = find_lowest_response_time_instance(cluster2_instances, inventory, detector, history)
+                best_instances_cluster1 = [best_instance_cluster1] if best_instance_cluster1 else []
+                best_instances_cluster2 = [best_instance_cluster2] if best_instance_cluster2 else []
 
             # Target group ARNs for each cluster
             tg_arn_cluster1 = get_target_group_arn("targets-large")
             tg_arn_cluster2 = get_target_group_arn("targets-micro")
             
             # Update the target groups with the best instance for each cluster
-            update_elb_target(tg_arn_cluster1, best_instance_cluster1, "t2.large")
-            update_elb_target(tg_arn_cluster2, best_instance_cluster2, "t2.micro")
+            update_elb_target(tg_arn_cluster1, best_instances_cluster1, cluster1_instances, batcher)
+            update_elb_target(tg_arn_cluster2, best_instances_cluster2, cluster2_instances, batcher)
+            calls = batcher.flush()
+            print(f"Target groups updated with {calls} API calls")
+            if best_instances_cluster1:
+                target_history.record('/cluster1', best_instances_cluster1)
+            if best_instances_cluster2:
+                target_history.record('/cluster2', best_instances_cluster2)
+            throttled_delay = g.probe_interval
 
             # Will find best instance every 0.1 seconds
-            print("Waiting 0.1 seconds before the next update...")
-            time.sleep(0.1)  # Will find best instance every 0.1 seconds
+            print(f"Waiting {g.probe_interval} seconds before the next update...")
+            time.sleep(g.probe_interval)  # Will find best instance every 0.1 seconds
+
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                print(f"An error occurred: {e}")
+                print("Retrying after 60 seconds...")
+                time.sleep(60)
+                continue
+            # Throttled despite the budget (other users of the account): back off exponentially, up to 10 seconds
+            throttled_delay = min(2 * throttled_delay, 10)
+            print(f"Throttled by AWS: {e}")
+            print(f"Retrying after {throttled_delay:.1f} seconds...")
+            time.sleep(throttled_delay)
 
         except Exception as e:
             print(f"An error occurred: {e}")
@@ -0,0 +1,128 @@
+import argparse
+import re
+import numpy as np
+
+# Matches the lines printed by benchmark.call_endpoint_http, with or without the latency suffix
+RESULT_LINE = re.compile(r"to (\S+): (?:Response: [^\n]*'(i-[0-9a-f]+)'\}(?: in ([0-9.]+)s)?|Failed)")
+
+'''
+Description: Parses the per-request lines of a benchmark output file such as benchmark_results.txt.
+Inputs: file_path (str) - The path of the benchmark output.
+Outputs: (endpoints, backends, latencies) (tuple) - NumPy arrays in the order the requests completed: the endpoint path,
+         the serving instance ID ('' for failed requests) and the latency in seconds (NaN when not recorded).
+'''
+def parse_results_file(file_path: str):
+    with open(file_path, 'r') as file:
+        matches = np.array(RESULT_LINE.findall(file.read()), dtype=str).reshape(-1, 3)
+    endpoints, backends, latency_strings = matches[:, 0], matches[:, 1], matches[:, 2]
+    latencies = np.full(len(matches), np.nan)
+    known = latency_strings != ''
+    latencies[known] = latency_strings[known].astype(float)
+    return endpoints, backends, latencies
+
+'''
+Description: Converts live benchmark results into the arrays analyzed by analyze.
+Inputs: results (list) - Dicts with 'path', 'backend' and 'latency' keys, such as the results of traffic_trace.replay_trace.
+Outputs: (endpoints, backends, latencies) (tuple) - NumPy arrays, in the order of `results`.
+'''
+def from_results(results: list):
+    endpoints = np.array([result['path'] for result in results], dtype=str)
+    backends = np.array([result.get('backend') or '' for result in results], dtype=str)
+    latencies = np.array([result.get('latency', np.nan) for result in results], dtype=float)
+    return endpoints, backends, latencies
+
+'''
+Description: Computes Jain's fairness index, (sum x)^2 / (n * sum x^2), of each row of a matrix of per-instance request counts.
+             It is 1 when traffic is spread evenly over the n instances and 1/n when a single instance gets all of it.
+Inputs: counts (numpy.ndarray) - A windows x instances matrix of request counts.
+Outputs: index (numpy.ndarray) - The fairness index of each window (NaN for windows without requests).
+'''
+def jain_index(counts):
+    counts = np.asarray(counts, dtype=float)
+    squares = (counts ** 2).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts.sum(axis=-1) ** 2 / (counts.shape[-1] * squares)
+
+'''
+Description: Analyzes how the requests of each endpoint were spread over the instances of its cluster.
+Inputs:
+    endpoints (numpy.ndarray) - The endpoint of each request.
+    backends (numpy.ndarray) - The instance that served each request, '' for failed requests.
+    latencies (numpy.ndarray) - The latency of each request in seconds, NaN when unknown.
+    window (int) - The number of consecutive requests per fairness window.
+    percentiles (list) - The latency percentiles to compute per instance.
+Outputs: report (dict) - Per endpoint: request and failure counts, overall fairness index, fairness index per window,
+         and per instance the request share and latency percentiles.
+'''
+def analyze(endpoints, backends, latencies, window: int = 100, percentiles: list = (50, 90, 99)):
+    report = {}
+    for endpoint in np.unique(endpoints):
+        in_endpoint = endpoints == endpoint
+        endpoint_backends = backends[in_endpoint]
+        endpoint_latencies = latencies[in_endpoint]
+        served = endpoint_backends != ''
+
+        instances, instance_codes = np.unique(endpoint_backends[served], return_inverse=True)
+        counts = np.bincount(instance_codes, minlength=len(instances))
+
+        # Windows are formed over the successful requests, in completion order
+        window_codes = np.arange(len(instance_codes)) // window
+        n_windows = int(window_codes[-1]) + 1 if len(window_codes) else 0
+        window_counts = np.bincount(window_codes * len(instances) + instance_codes,
+                                    minlength=n_windows * len(instances)).reshape(n_windows, len(instances))
+
+        # Sort by instance then latency, so each instance's known latencies are one contiguous sorted slice
+        served_latencies = endpoint_latencies[served]
+        known = ~np.isnan(served_latencies)
+        known_codes = instance_codes[known]
+        order = np.lexsort((served_latencies[known], known_codes))
+        sorted_latencies = served_latencies[known][order]
+        bounds = np.searchsorted(known_codes[order], np.arange(len(instances) + 1))
+
+        instance_reports = {}
+        for code, instance_id in enumerate(instances):
+            instance_latencies = sorted_latencies[bounds[code]:bounds[code + 1]]
+            instance_reports[str(instance_id)] = {
+                'requests': int(counts[code]),
+                'share': float(counts[code] / counts.sum()),
+                'latency': {p: float(np.percentile(instance_latencies, p)) for p in percentiles} if len(instance_latencies) else {},
+            }
+
+        report[str(endpoint)] = {
+            'requests': int(in_endpoint.sum()),
+            'failed': int((~served).sum()),
+            'fairness': float(jain_index(counts)) if len(instances) else float('nan'),
+            'window_fairness': jain_index(window_counts) if len(instances) else np.array([]),
+            'instances': instance_reports,
+        }
+    return report
+
+'''
+Description: Prints the report returned by analyze.
+Inputs:
+    report (dict) - The report.
+    window (int) - The fairness window size used, for display.
+'''
+def print_report(report: dict, window: int):
+    for endpoint, endpoint_report in report.items():
+        print(f"\n--- {endpoint}: {endpoint_report['requests']} requests, {endpoint_report['failed']} failed ---")
+        for instance_id, instance_report in endpoint_report['instances'].items():
+            latency = ', '.join(f"p{p}: {value * 1000:.2f}ms" for p, value in instance_report['latency'].items())
+            print(f"Instance {instance_id}: {instance_report['requests']} requests ({instance_report['share']:.1%}){', ' + latency if latency else ''}")
+
+        print(f"Jain's fairness index: {endpoint_report['fairness']:.3f}")
+        window_fairness = endpoint_report['window_fairness']
+        if len(window_fairness) > 1:
+            print(f"Per {window} requests: min {np.nanmin(window_fairness):.3f}, mean {np.nanmean(window_fairness):.3f}, "
+                  f"last {window_fairness[-1]:.3f} over {len(window_fairness)} windows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze how benchmark traffic was spread over the cluster instances.")
+    parser.add_argument('files', nargs='+', help="benchmark output files, e.g. benchmark_results.txt")
+    parser.add_argument('--window', type=int, default=100, help="requests per fairness window (default: 100)")
+    args = parser.parse_args()
+
+    for file_path in args.files:
+        print(f"=== {file_path} ===")
+        print_report(analyze(*parse_results_file(file_path), window=args.window), args.window)
@@ -0,0 +1,239 @@
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import paramiko
+import aws_clients
+import globals as g
+
+'''
+Description: Runs commands and uploads files on many EC2 instances at once over SSH.
+             One authenticated session per host is kept open and reused, and at most `max_parallel` hosts are worked on at a time.
+Inputs:
+    pem_file_path (str) - The file path to the PEM file used for SSH authentication.
+    username (str) - The SSH user.
+    max_parallel (int) - The maximum number of hosts worked on concurrently.
+    connect_retries (int) - Connection attempts per host before giving up.
+    connect_timeout (float) - Seconds to wait for a connection attempt.
+'''
+class FleetRunner:
+    def __init__(self, pem_file_path: str, username: str = 'ubuntu', max_parallel: int = 16, connect_retries: int = 3, connect_timeout: float = 10):
+        self.pem_file_path = pem_file_path
+        self.username = username
+        self.max_parallel = max_parallel
+        self.connect_retries = connect_retries
+        self.connect_timeout = connect_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.output_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    '''
+    Description: Returns the open SSH session to a host, connecting (with retries) if there is none or it was dropped.
+    Inputs: host (str) - The IP address or DNS name of the host.
+    Outputs: ssh (paramiko.SSHClient) - The connected session.
+    '''
+    def get_session(self, host: str):
+        with self.lock:
+            ssh = self.sessions.get(host)
+        if ssh is not None and ssh.get_transport() is not None and ssh.get_transport().is_active():
+            return ssh
+
+        for attempt in range(1, self.connect_retries + 1):
+            try:
+                ssh = paramiko.SSHClient()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh.connect(host, username=self.username, key_filename=self.pem_file_path, timeout=self.connect_timeout)
+                with self.lock:
+                    self.sessions[host] = ssh
+                return ssh
+            except Exception as e:
+                if attempt == self.connect_retries:
+                    raise
+                print(f"[{host}] Connection attempt {attempt} failed: {str(e)}, retrying...")
+                time.sleep(2 ** attempt)
+
+    def _print_lines(self, host: str, buffer: str, final: bool = False):
+        # Prints the complete lines of `buffer` prefixed with the host and returns the incomplete rest
+        lines = buffer.split('\n')
+        rest = '' if final else lines.pop()
+        with self.output_lock:
+            for line in lines:
+                if line or not final:
+                    print(f"[{host}] {line}")
+        return rest
+
+    '''
+    Description: Runs a command on one host, streaming its output as it arrives.
+    Inputs:
+        host (str) - The IP address or DNS name of the host.
+        command (str) - The shell command to run.
+        timeout (float) - Seconds after which the command is abandoned, or None to wait for it.
+        stream (bool) - Whether to print the output lines, prefixed with the host, while the command runs.
+    Outputs: result (dict) - The host, exit status (None if the command could not be run), stdout, stderr and error message.
+    '''
+    def run_command(self, host: str, command: str, timeout: float = None, stream: bool = True):
+        result = {'host': host, 'exit_status': None, 'stdout': '', 'stderr': '', 'error': None}
+        try:
+            channel = self.get_session(host).get_transport().open_session()
+            channel.exec_command(command)
+            started = time.monotonic()
+            stdout_rest, stderr_rest = '', ''
+            while True:
+                received = False
+                if channel.recv_ready():
+                    data = channel.recv(32768).decode(errors='replace')
+                    result['stdout'] += data
+                    stdout_rest = self._print_lines(host, stdout_rest + data) if stream else ''
+                    received = True
+                if channel.recv_stderr_ready():
+                    data = channel.recv_stderr(32768).decode(errors='replace')
+                    result['stderr'] += data
+                    stderr_rest = self._print_lines(host, stderr_rest + data) if stream else ''
+                    received = True
+                if not received:
+                    if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    if timeout is not None and time.monotonic() - started > timeout:
+                        channel.close()
+                        raise TimeoutError(f"command did not finish within {timeout} seconds")
+                    time.sleep(0.01)
+            if stream:
+                self._print_lines(host, stdout_rest, final=True)
+                self._print_lines(host, stderr_rest, final=True)
+            result['exit_status'] = channel.recv_exit_status()
+            channel.close()
+        except Exception as e:
+            result['error'] = str(e)
+            print(f"[{host}] Failed to run command: {str(e)}")
+        return result
+
+    '''
+    Description: Uploads files to one host over SFTP.
+    Inputs:
+        host (str) - The IP address or DNS name of the host.
+        files (list) - A list of (local path, remote path) tuples.
+    Outputs: result (dict) - The host, the uploaded remote paths and the error message, if any.
+    '''
+    def upload_files(self, host: str, files: list):
+        result = {'host': host, 'uploaded': [], 'error': None}
+        try:
+            sftp = self.get_session(host).open_sftp()
+            try:
+                for local_path, remote_path in files:
+                    sftp.put(local_path, remote_path)
+                    result['uploaded'].append(remote_path)
+            finally:
+                sftp.close()
+            print(f"[{host}] Uploaded {len(result['uploaded'])} files")
+        except Exception as e:
+            result['error'] = str(e)
+            print(f"[{host}] Failed to upload files: {str(e)}")
+        return result
+
+    def _map(self, function, hosts: list, *args):
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_parallel, len(hosts)))) as executor:
+            return dict(zip(hosts, executor.map(lambda host: function(host, *args), hosts)))
+
+    '''
+    Description: Runs a command on every host, at most `max_parallel` at a time.
+    Inputs:
+        hosts (list) - The IP addresses or DNS names of the hosts.
+        command (str) - The shell command to run.
+        timeout (float) - Seconds after which the command is abandoned on a host, or None to wait for it.
+        stream (bool) - Whether to print the output lines while the commands run.
+    Outputs: results (dict) - A mapping of host to the result returned by run_command.
+    '''
+    def run(self, hosts: list, command: str, timeout: float = None, stream: bool = True):
+        return self._map(self.run_command, hosts, command, timeout, stream)
+
+    '''
+    Description: Uploads files to every host, at most `max_parallel` at a time.
+    Inputs:
+        hosts (list) - The IP addresses or DNS names of the hosts.
+        files (list) - A list of (local path, remote path) tuples.
+    Outputs: results (dict) - A mapping of host to the result returned by upload_files.
+    '''
+    def upload(self, hosts: list, files: list):
+        return self._map(self.upload_files, hosts, files)
+
+    '''
+    Description: Closes every open SSH session.
+    '''
+    def close(self):
+        with self.lock:
+            for ssh in self.sessions.values():
+                ssh.close()
+            self.sessions.clear()
+
+'''
+Description: Retrieves the public IP addresses of the running instances with a given Name tag.
+Inputs: instance_name (str) - The Name tag to filter by, e.g. 'FastAPI-Instance'.
+Outputs: hosts (list) - The public IP addresses of the matching instances.
+'''
+def get_hosts_by_name(instance_name: str):
+    response = aws_clients.get_client('ec2').describe_instances(
+        Filters=[
+            {'Name': 'tag:Name', 'Values': [instance_name]},
+            {'Name': 'instance-state-name', 'Values': ['running']}
+        ]
+    )
+    return [
+        instance['PublicIpAddress']
+        for reservation in response['Reservations']
+        for instance in reservation['Instances']
+        if instance.get('PublicIpAddress')
+    ]
+
+'''
+Description: Prints a one-line summary per host and returns whether every host succeeded.
+Inputs: results (dict) - A mapping of host to the result returned by run_command.
+Outputs: success (bool) - True if the command exited with status 0 on every host.
+'''
+def print_summary(results: dict):
+    success = True
+    print("\n--- Summary ---")
+    for host, result in results.items():
+        if result['error'] is not None:
+            print(f"{host}: error - {result['error']}")
+            success = False
+        else:
+            print(f"{host}: exit status {result['exit_status']}")
+            success = success and result['exit_status'] == 0
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run commands or upload files on a fleet of EC2 instances.")
+    parser.add_argument('--name', default='FastAPI-Instance', help="Name tag of the target instances (default: FastAPI-Instance)")
+    parser.add_argument('--hosts', nargs='+', help="target these hosts instead of looking them up by name")
+    parser.add_argument('--parallel', type=int, default=16, help="maximum number of hosts worked on at a time (default: 16)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run a shell command on every host")
+    run_parser.add_argument('shell_command', help="the command to run")
+    run_parser.add_argument('--timeout', type=float, help="seconds after which the command is abandoned")
+
+    upload_parser = subparsers.add_parser('upload', help="upload files to every host")
+    upload_parser.add_argument('files', nargs='+', metavar='LOCAL:REMOTE', help="local and remote path separated by a colon")
+    args = parser.parse_args()
+
+    hosts = args.hosts or get_hosts_by_name(args.name)
+    if not hosts:
+        print("No hosts found.")
+        sys.exit(1)
+    print(f"Targeting {len(hosts)} hosts: {hosts}")
+
+    with FleetRunner(g.pem_file_path, max_parallel=args.parallel) as runner:
+        if args.command == 'run':
+            ok = print_summary(runner.run(hosts, args.shell_command, args.timeout))
+        else:
+            files = [tuple(spec.split(':', 1)) for spec in args.files]
+            ok = all(result['error'] is None for result in runner.upload(hosts, files).values())
+    sys.exit(0 if ok else 1)
@@ -10,3 +10,47 @@ targer_group_micro_name = "targets-micro"
 targer_group_large_name = "targets-large"
 
 
+# Folder where benchmark.py saves a structured record of every run
+benchmark_runs_folder = "benchmark_runs"
+
+# SQS queue (and EventBridge rule) receiving EC2 instance state-change events for the traffic manager
+instance_events_queue_name = "instance-state-events"
+# Seconds between full describe_instances reconciles of the instance inventory
+inventory_reconcile_interval = 300
+
+# Seconds between two probe rounds of the traffic manager
+probe_interval = 0.1
+# JSON lines file of response outcomes ({"backend": ..., "path": ..., "status": ...}) fed to outlier detection, None to disable.
+# On the traffic manager's instance it is relative to /home/ubuntu, see benchmark.py --outcome-host
+outcome_log_path = None
+# Seconds a response outcome may take to reach the outcome log. A failed response is charged to the target registered for
+# its cluster since the previous read minus this delay, and dropped if more than one instance was registered in that time
+outcome_delay = 0.5
+
+# Zone-aware routing: register the best instance of each availability zone, with cross-zone load balancing disabled
+zone_aware_routing = False
+# A zone spills over to the others when its best response time is this many times the best overall
+zone_spill_latency_factor = 2.0
+# A zone spills over to the others when less than this fraction of its instances is available
+zone_min_capacity = 0.5
+
+# Memory-mapped ring file keeping the traffic manager's probe samples and routing decisions
+probe_history_path = "probe_history.bin"
+# Number of samples kept in the probe history (20 bytes each)
+probe_history_capacity = 1000000
+
+# AWS API budget of one process, shared by all of its clients: (calls per second, burst) per operation.
+# The buckets are per process while AWS throttles per account and region, so every rate is sized as one process's share:
+# the traffic manager and one benchmark or script running at the same time each get about half of the account's limit
+# (e.g. DescribeInstances refills at 20 calls per second)
+aws_api_rates = {
+    'DescribeInstances': (10, 20),
+    'DescribeTargetGroups': (5, 10),
+    'DescribeTargetHealth': (5, 10),
+    'RegisterTargets': (5, 10),
+    'DeregisterTargets': (5, 10),
+}
+# (calls per second, burst) of the operations not listed above
+aws_api_default_rate = (10, 20)
+# Seconds after which the traffic manager re-sends its target registrations, even if they did not change
+registration_resync_interval = 60
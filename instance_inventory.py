@@ -0,0 +1,265 @@
+import json
+import queue
+import threading
+import time
+
+# States in which an instance is kept in the inventory; every other state removes it
+ACTIVE_STATES = ('pending', 'running')
+EVENT_DETAIL_TYPE = 'EC2 Instance State-change Notification'
+
+'''
+Description: In-memory instance state-change queue, used when the SQS queue does not exist and as the local buffer of SqsEventQueue.
+             Events put on it are handed to the inventory on its next refresh.
+'''
+class LocalEventQueue:
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def put(self, event: dict):
+        self.events.put(event)
+
+    '''
+    Description: Returns the queued events without blocking.
+    Outputs: events (list) - The events received since the last call.
+    '''
+    def receive(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+'''
+Description: Instance state-change events delivered by an EventBridge rule to an SQS queue.
+             A daemon thread long-polls the queue, so the control loop only drains a local queue and never waits on SQS.
+'''
+class SqsEventQueue(LocalEventQueue):
+    def __init__(self, sqs_client, queue_url: str, wait_time: int = 20):
+        super().__init__()
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.wait_time = wait_time
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+
+    def _poll(self):
+        while True:
+            try:
+                response = self.sqs_client.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=10,
+                    WaitTimeSeconds=self.wait_time,
+                )
+                messages = response.get('Messages', [])
+                for message in messages:
+                    self.put(json.loads(message['Body']))
+                if messages:
+                    self.sqs_client.delete_message_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[{'Id': str(i), 'ReceiptHandle': m['ReceiptHandle']} for i, m in enumerate(messages)],
+                    )
+            except Exception as e:
+                # Missed events are caught up by the next full reconcile
+                print(f"Error receiving instance events: {str(e)}")
+                time.sleep(self.wait_time)
+
+'''
+Description: Opens the instance state-change queue with the given name, falling back to a local queue if it does not exist.
+             With the local queue the inventory is only updated by its periodic full reconcile.
+Inputs:
+    sqs_client (boto3.client) - The SQS client instance.
+    queue_name (str) - The name of the SQS queue.
+Outputs: event_queue (LocalEventQueue) - The event queue.
+'''
+def open_event_queue(sqs_client, queue_name: str):
+    try:
+        queue_url = sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+    except Exception as e:
+        print(f"Instance event queue {queue_name} not available, relying on periodic reconcile: {str(e)}")
+        return LocalEventQueue()
+    print(f"Receiving instance events from {queue_url}")
+    return SqsEventQueue(sqs_client, queue_url)
+
+'''
+Description: Creates the SQS queue and the EventBridge rule that forwards EC2 instance state-change events to it.
+Inputs:
+    sqs_client (boto3.client) - The SQS client instance.
+    events_client (boto3.client) - The EventBridge client instance.
+    queue_name (str) - The name of the queue and of the rule.
+Outputs: queue_url (str) - The URL of the queue.
+'''
+def create_event_queue(sqs_client, events_client, queue_name: str):
+    queue_url = sqs_client.create_queue(QueueName=queue_name)['QueueUrl']
+    queue_arn = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+
+    rule_arn = events_client.put_rule(
+        Name=queue_name,
+        EventPattern=json.dumps({'source': ['aws.ec2'], 'detail-type': [EVENT_DETAIL_TYPE]}),
+        State='ENABLED',
+    )['RuleArn']
+
+    # Allow the rule to send messages to the queue
+    policy = {
+        'Version': '2012-10-17',
+        'Statement': [{
+            'Effect': 'Allow',
+            'Principal': {'Service': 'events.amazonaws.com'},
+            'Action': 'sqs:SendMessage',
+            'Resource': queue_arn,
+            'Condition': {'ArnEquals': {'aws:SourceArn': rule_arn}},
+        }],
+    }
+    sqs_client.set_queue_attributes(QueueUrl=queue_url, Attributes={'Policy': json.dumps(policy)})
+    events_client.put_targets(Rule=queue_name, Targets=[{'Id': 'instance-event-queue', 'Arn': queue_arn}])
+
+    print(f"Instance events are forwarded to {queue_url}")
+    return queue_url
+
+'''
+Description: Deletes the EventBridge rule and the SQS queue created by create_event_queue, if they exist.
+Inputs:
+    sqs_client (boto3.client) - The SQS client instance.
+    events_client (boto3.client) - The EventBridge client instance.
+    queue_name (str) - The name of the queue and of the rule.
+'''
+def delete_event_queue(sqs_client, events_client, queue_name: str):
+    try:
+        events_client.remove_targets(Rule=queue_name, Ids=['instance-event-queue'])
+        events_client.delete_rule(Name=queue_name)
+        print(f"Deleted event rule: {queue_name}")
+    except events_client.exceptions.ResourceNotFoundException:
+        pass
+    try:
+        sqs_client.delete_queue(QueueUrl=sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl'])
+        print(f"Deleted event queue: {queue_name}")
+    except sqs_client.exceptions.QueueDoesNotExist:
+        pass
+
+'''
+Description: Returns the inventory entry for an instance description returned by describe_instances.
+Inputs: instance (dict) - The instance description.
+Outputs: entry (dict) - The instance type, state, public IP and availability zone.
+'''
+def _make_entry(instance: dict):
+    return {
+        'instance_type': instance['InstanceType'],
+        'state': instance['State']['Name'],
+        'public_ip': instance.get('PublicIpAddress'),
+        'zone': instance.get('Placement', {}).get('AvailabilityZone'),
+    }
+
+'''
+Description: Keeps track of the active EC2 instances incrementally, from instance state-change events,
+             with a slow periodic full reconcile against describe_instances to guard against missed events.
+'''
+class InstanceInventory:
+    def __init__(self, ec2_client, event_queue=None, reconcile_interval: float = 300):
+        self.ec2_client = ec2_client
+        self.event_queue = event_queue if event_queue is not None else LocalEventQueue()
+        self.reconcile_interval = reconcile_interval
+        self.instances = {}
+        self.event_times = {}
+        self.last_reconcile = None
+
+    def _describe(self, **kwargs):
+        instances = {}
+        paginator = self.ec2_client.get_paginator('describe_instances')
+        for page in paginator.paginate(**kwargs):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if instance['State']['Name'] in ACTIVE_STATES:
+                        instances[instance['InstanceId']] = _make_entry(instance)
+        return instances
+
+    '''
+    Description: Replaces the inventory with a full describe_instances listing and reports any drift from the incremental state.
+    '''
+    def reconcile(self):
+        instances = self._describe(Filters=[{'Name': 'instance-state-name', 'Values': list(ACTIVE_STATES)}])
+        if self.last_reconcile is not None:
+            added = set(instances) - set(self.instances)
+            removed = set(self.instances) - set(instances)
+            if added or removed:
+                print(f"Inventory drift corrected, added: {sorted(added)}, removed: {sorted(removed)}")
+        self.instances = instances
+        # Late events of instances that are gone are harmless from now on: describing them no longer returns an active instance
+        self.event_times = {instance_id: t for instance_id, t in self.event_times.items() if instance_id in instances}
+        self.last_reconcile = time.monotonic()
+
+    '''
+    Description: Applies one instance state-change event to the inventory.
+    Inputs: event (dict) - The event, in the shape EventBridge delivers it.
+    '''
+    def apply_event(self, event: dict):
+        if event.get('detail-type') != EVENT_DETAIL_TYPE:
+            return
+        instance_id = event['detail']['instance-id']
+        state = event['detail']['state']
+
+        # A standard SQS queue can deliver events out of order: ignore events older than the last one applied to the instance.
+        # Event times are ISO 8601 UTC timestamps, which compare in time order as strings.
+        event_time = event.get('time', '')
+        if event_time < self.event_times.get(instance_id, ''):
+            print(f"Ignoring out of order {state} event of instance {instance_id}")
+            return
+        self.event_times[instance_id] = event_time
+
+        if state not in ACTIVE_STATES:
+            if self.instances.pop(instance_id, None) is not None:
+                print(f"Instance {instance_id} is {state}, removed from inventory")
+            return
+
+        entry = self.instances.get(instance_id)
+        if entry is not None and state == 'pending' and entry['state'] == 'running':
+            # Events only have a one second resolution, a late pending event can carry the same time as the running one
+            return
+        if entry is not None and (state == 'pending' or entry['public_ip']):
+            entry['state'] = state
+            return
+
+        # Events do not carry the instance details, describe the new instance once
+        try:
+            described = self._describe(InstanceIds=[instance_id])
+        except Exception as e:
+            print(f"Error describing instance {instance_id}: {str(e)}")
+            return
+        if instance_id in described:
+            self.instances[instance_id] = described[instance_id]
+            print(f"Instance {instance_id} is {state}, added to inventory")
+
+    '''
+    Description: Applies the pending events, and runs a full reconcile first if it is due.
+    '''
+    def refresh(self):
+        if self.last_reconcile is None or time.monotonic() - self.last_reconcile >= self.reconcile_interval:
+            self.reconcile()
+        for event in self.event_queue.receive():
+            self.apply_event(event)
+
+    '''
+    Description: Returns the running instances of a given type.
+    Inputs: instance_type (str) - The type of instances to filter by (e.g., 't2.micro').
+    Outputs: instances (list) - The IDs of the running instances of that type.
+    '''
+    def get_instances(self, instance_type: str):
+        return sorted(
+            instance_id for instance_id, entry in self.instances.items()
+            if entry['instance_type'] == instance_type and entry['state'] == 'running'
+        )
+
+    '''
+    Description: Returns the public IP address of an instance, or None if it is unknown.
+    Inputs: instance_id (str) - The ID of the instance.
+    '''
+    def get_public_ip(self, instance_id: str):
+        entry = self.instances.get(instance_id)
+        return entry['public_ip'] if entry else None
+
+    '''
+    Description: Returns the availability zone of an instance, or None if it is unknown.
+    Inputs: instance_id (str) - The ID of the instance.
+    '''
+    def get_zone(self, instance_id: str):
+        entry = self.instances.get(instance_id)
+        return entry['zone'] if entry else None
@@ -1,4 +1,4 @@
-import boto3
+import aws_clients
 import os
 import stat
 
@@ -14,9 +14,8 @@ Outputs:
 # Allows HTTP traffic on port 80
 # Returns the security group ID
 def createSecurityGroup(vpc_id: str, group_name: str):
-    # Create EC2 Client
-    session = boto3.Session()
-    ec2 = session.resource('ec2')
+    # Get the shared EC2 resource
+    ec2 = aws_clients.get_resource('ec2')
 
     response = ec2.create_security_group(GroupName=group_name,
                                          Description='Description',
@@ -44,36 +43,45 @@ def createSecurityGroup(vpc_id: str, group_name: str):
     return security_group_id
 
 '''
-Description: Creates an EC2 instance with the specified parameters and waits for it to enter the running state.
+Description: Creates EC2 instances with the specified parameters, spread round-robin over the given subnets (and so over their
+             availability zones), and waits for them to enter the running state.
 Inputs: 
     instanceType (str) - The type of instance to create (e.g., 't2.micro').
     minCount (int) - The minimum number of instances to launch.
     maxCount (int) - The maximum number of instances to launch.
     key_pair (boto3.KeyPair) - The key pair used for SSH access.
     security_id (str) - The security group ID associated with the instance.
-    subnet_id (str) - The subnet ID where the instance will be launched.
+    subnet_id (str or list) - The subnet ID, or list of subnet IDs, where the instances will be launched.
     user_data (str) - The user data script to configure the instance at launch.
     instance_name (str) - The name to assign to the created instance.
 Outputs: 
     instances (list) - A list of created instance objects.
 '''
-def createInstance(instanceType: str, minCount: int, maxCount: int, key_pair, security_id: str, subnet_id: str, user_data: str, instance_name: str):
+def createInstance(instanceType: str, minCount: int, maxCount: int, key_pair, security_id: str, subnet_id, user_data: str, instance_name: str):
     
-    # Create EC2 Client
-    session = boto3.Session()
-    ec2 = session.resource('ec2')
+    # Get the shared EC2 resource
+    ec2 = aws_clients.get_resource('ec2')
 
+    subnet_ids = [subnet_id] if isinstance(subnet_id, str) else list(subnet_id)
 
-    instances = ec2.create_instances(
-        ImageId='ami-0e86e20dae9224db8',
-        InstanceType=instanceType,
-        MinCount=minCount,
-        MaxCount=maxCount,
-        KeyName=key_pair.name,
-        SecurityGroupIds=[security_id],
-        SubnetId=subnet_id,
-        UserData=user_data
-    )
+    instances = []
+    for index, subnet in enumerate(subnet_ids):
+        # Subnet i gets every len(subnet_ids)-th instance, starting with the i-th
+        subnet_min_count = len(range(index, minCount, len(subnet_ids)))
+        subnet_max_count = len(range(index, maxCount, len(subnet_ids)))
+        if subnet_max_count == 0:
+            continue
+
+        instances += ec2.create_instances(
+            ImageId='ami-0e86e20dae9224db8',
+            InstanceType=instanceType,
+            MinCount=max(subnet_min_count, 1),
+            MaxCount=subnet_max_count,
+            KeyName=key_pair.name,
+            SecurityGroupIds=[security_id],
+            SubnetId=subnet,
+            UserData=user_data
+        )
 
     # Wait until the instances are running
     for instance in instances:
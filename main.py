@@ -2,42 +2,57 @@
 import time
 import os
 import globals as g
-import boto3
+import aws_clients
 import stat
-import paramiko
 
 import instance_setup as ic
 import elb_setup as elbs
 import benchmark as bm
+import fleet_runner as fr
+import instance_inventory as ii
+
+# Modules the traffic manager needs on the ELB instance
+MANAGER_FILES = [
+    'elb_traffic_manager.py',
+    'aws_api_budget.py',
+    'aws_clients.py',
+    'globals.py',
+    'instance_inventory.py',
+    'outlier_detection.py',
+    'probe_history.py',
+]
 
 '''
-Description: Connects to an EC2 instance via SSH and runs a specified Python script.
+Description: Deploys the traffic manager to EC2 instances via SSH and starts it in the background.
+Inputs: 
+    instance_ips (list) - The public IP addresses of the EC2 instances.
+    pem_file_path (str) - The file path to the PEM file used for SSH authentication.
+Outputs: success (bool) - True if the manager was started on every instance.
+'''
+def deploy_traffic_manager(instance_ips: list, pem_file_path: str):
+    with fr.FleetRunner(pem_file_path) as runner:
+        print(f"Uploading the traffic manager to {instance_ips}...")
+        upload_results = runner.upload(instance_ips, [(path, f'/home/ubuntu/{path}') for path in MANAGER_FILES])
+        hosts = [host for host, result in upload_results.items() if result['error'] is None]
+
+        print("Running 'python3 elb_traffic_manager.py'...")
+        # Stop the previously deployed manager through its pidfile (a pkill pattern would also match this shell's own command line),
+        # then detach the new one so that it keeps running once the SSH session is closed
+        results = runner.run(hosts, 'cd /home/ubuntu && kill $(cat elb_traffic_manager.pid 2>/dev/null) 2>/dev/null; '
+                                    'nohup python3 elb_traffic_manager.py > elb_traffic_manager.log 2>&1 < /dev/null & '
+                                    'echo $! > elb_traffic_manager.pid; echo "started pid $!"')
+        return len(hosts) == len(instance_ips) and fr.print_summary(results)
+
+'''
+Description: Connects to an EC2 instance via SSH and runs the traffic manager script.
 Inputs: 
     instance_ip (str) - The public IP address of the EC2 instance.
     pem_file_path (str) - The file path to the PEM file used for SSH authentication.
 Outputs: None (prints connection status and script execution results).
 '''
 def ssh_and_run_script(instance_ip: str, pem_file_path: str):
-    try:
-        print(f"Connecting to {instance_ip} using SSH...")
-        # Initialize SSH client
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        # Connect to the instance
-        ssh.connect(instance_ip, username='ubuntu', key_filename=pem_file_path)
-        
-        print("Connected! Now running 'python3 elb_traffic_manager.py'...")
-        
-        # Run the command to execute the Python script
-        stdin, stdout, stderr = ssh.exec_command('python3 elb_traffic_manager.py')
-        
-        # Close the SSH connection
-        ssh.close()
-        print("SSH connection closed.")
-
-    except Exception as e:
-        print(f"An error occurred during SSH: {str(e)}")
+    if not deploy_traffic_manager([instance_ip], pem_file_path):
+        print(f"An error occurred while starting the traffic manager on {instance_ip}")
 
 
 if __name__ == "__main__":
@@ -46,9 +61,8 @@ if __name__ == "__main__":
     pem_file_path = g.pem_file_path
 
 
-    # Create EC2 Client
-    session = boto3.Session()
-    ec2 = session.resource('ec2')
+    # Get the shared EC2 resource
+    ec2 = aws_clients.get_resource('ec2')
 
     # Read VPC and Subnet IDs from files
     with open(f'{g.aws_folder_path}/vpc_id.txt', 'r') as file:
@@ -57,6 +71,9 @@ if __name__ == "__main__":
     with open(f'{g.aws_folder_path}/subnet_id.txt', 'r') as file:
         subnet_id = file.read().strip()
 
+    # Subnets in different availability zones, the FastAPI instances are spread over them
+    subnet_ids, _ = elbs.read_aws_resource_ids()
+
 
     # Delete keypair with same name, USED IN TESTING
     # ec2.KeyPair("key_name").delete()
@@ -86,8 +103,8 @@ if __name__ == "__main__":
 
     print("Creating instances...")
     # FastApi instances - 3x large & 5x micro
-    ic.createInstance('t2.large', 2, 2, key_pair, security_id, subnet_id, api_user_data, "FastAPI-Instance") # For cluster1
-    ic.createInstance('t2.micro', 2, 2, key_pair, security_id, subnet_id, api_user_data, "FastAPI-Instance") # For cluster2
+    ic.createInstance('t2.large', 2, 2, key_pair, security_id, subnet_ids, api_user_data, "FastAPI-Instance") # For cluster1
+    ic.createInstance('t2.micro', 2, 2, key_pair, security_id, subnet_ids, api_user_data, "FastAPI-Instance") # For cluster2
 
     print("Waiting for instances to be up and running...")
     time.sleep(180)
@@ -97,6 +114,9 @@ if __name__ == "__main__":
     # Sets up the ELB client and configures the target groups
     elbs.main()
 
+    # Forward instance state-change events to the queue the traffic manager listens on
+    ii.create_event_queue(aws_clients.get_client('sqs'), aws_clients.get_client('events'), g.instance_events_queue_name)
+
     print("Waiting for ELB setup to be completed...")
     time.sleep(180)
 
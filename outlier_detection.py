@@ -0,0 +1,316 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+'''
+Description: Per-instance outlier state: recent outcomes, consecutive failures, ejection and probation.
+'''
+class InstanceHealth:
+    def __init__(self, window: int):
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.ejection_count = 0
+        self.ejected_until = None
+        self.readmitted_at = None
+        self.probation_remaining = 0
+
+'''
+Description: Passive outlier detection for the backends of a cluster.
+             Active probes and response outcomes are recorded per instance. A failed probe, a run of consecutive failed
+             responses or a high error ratio ejects the instance from selection. It is re-admitted after an exponentially
+             growing ejection time and then stays on probation: a failure before it has passed enough probes ejects it again.
+Inputs:
+    consecutive_failures (int) - Failed responses in a row that eject an instance.
+    error_ratio (float) - Error ratio over the outcome window that ejects an instance.
+    window (int) - The number of recent outcomes the error ratio is computed over.
+    min_outcomes (int) - The number of outcomes needed before the error ratio is used.
+    base_ejection_time (float) - Seconds of the first ejection; doubled by every ejection in a row.
+    max_ejection_time (float) - Upper bound of the ejection time, and how long an instance must stay healthy to reset the backoff.
+    probation_successes (int) - Successful outcomes needed after re-admission to leave probation.
+    max_outcome_age (float) - Seconds after which a response outcome is too old to say anything about the instance and is dropped.
+'''
+class OutlierDetector:
+    def __init__(self, consecutive_failures: int = 5, error_ratio: float = 0.5, window: int = 20, min_outcomes: int = 10,
+                 base_ejection_time: float = 1.0, max_ejection_time: float = 60.0, probation_successes: int = 3,
+                 max_outcome_age: float = 10.0):
+        self.consecutive_failures = consecutive_failures
+        self.error_ratio = error_ratio
+        self.window = window
+        self.min_outcomes = min_outcomes
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.probation_successes = probation_successes
+        self.max_outcome_age = max_outcome_age
+        self.instances = {}
+
+    def _get_health(self, instance_id: str):
+        health = self.instances.get(instance_id)
+        if health is None:
+            health = self.instances[instance_id] = InstanceHealth(self.window)
+        return health
+
+    def _eject(self, instance_id: str, health: InstanceHealth, now: float, reason: str):
+        # Reset the backoff of instances that stayed healthy long enough since their last re-admission
+        if health.readmitted_at is not None and now - health.readmitted_at > self.max_ejection_time and not health.probation_remaining:
+            health.ejection_count = 0
+        health.ejection_count += 1
+        ejection_time = min(self.base_ejection_time * 2 ** (health.ejection_count - 1), self.max_ejection_time)
+        health.ejected_until = now + ejection_time
+        health.probation_remaining = self.probation_successes
+        health.consecutive_failures = 0
+        health.outcomes.clear()
+        print(f"Ejecting instance {instance_id} for {ejection_time:.1f} seconds ({reason})")
+
+    '''
+    Description: Records the outcome of a probe or of a response served by an instance.
+    Inputs:
+        instance_id (str) - The ID of the instance.
+        success (bool) - Whether the probe or response succeeded.
+        active (bool) - True for an active probe, whose failure ejects the instance right away.
+        now (float) - The time.monotonic() timestamp of the outcome; defaults to now. Outcomes older than
+                      max_outcome_age, or from before the instance's last re-admission, are dropped.
+    '''
+    def record(self, instance_id: str, success: bool, active: bool = False, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        elif time.monotonic() - now > self.max_outcome_age:
+            return
+        health = self._get_health(instance_id)
+        if health.ejected_until is not None and now < health.ejected_until:
+            # Late outcomes of requests sent before the ejection
+            return
+        if health.readmitted_at is not None and now < health.readmitted_at:
+            # Outcomes of the previous ejection period, the instance starts over on probation
+            return
+        health.outcomes.append(success)
+
+        if success:
+            health.consecutive_failures = 0
+            if health.probation_remaining:
+                health.probation_remaining -= 1
+                if not health.probation_remaining:
+                    print(f"Instance {instance_id} passed probation")
+            return
+
+        health.consecutive_failures += 1
+        failures = health.outcomes.count(False)
+        if active:
+            self._eject(instance_id, health, now, "probe failed")
+        elif health.probation_remaining:
+            self._eject(instance_id, health, now, "failed on probation")
+        elif health.consecutive_failures >= self.consecutive_failures:
+            self._eject(instance_id, health, now, f"{health.consecutive_failures} consecutive failures")
+        elif len(health.outcomes) >= self.min_outcomes and failures / len(health.outcomes) >= self.error_ratio:
+            self._eject(instance_id, health, now, f"error ratio {failures / len(health.outcomes):.2f}")
+
+    '''
+    Description: Returns whether an instance can be selected, i.e. it is not currently ejected.
+    Inputs:
+        instance_id (str) - The ID of the instance.
+        now (float) - The time.monotonic() timestamp to check at; defaults to now.
+    '''
+    def is_available(self, instance_id: str, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        health = self.instances.get(instance_id)
+        if health is None or health.ejected_until is None:
+            return True
+        if now < health.ejected_until:
+            return False
+        # Ejection expired: re-admit on probation
+        health.ejected_until = None
+        health.readmitted_at = now
+        print(f"Re-admitting instance {instance_id} on probation")
+        return True
+
+    '''
+    Description: Filters the ejected instances out of a list of instances.
+                 If every instance is ejected, all of them are returned so that the cluster keeps a target.
+    Inputs: instances (list) - The instance IDs to filter.
+    Outputs: available (list) - The instance IDs that can be selected.
+    '''
+    def filter_available(self, instances: list):
+        now = time.monotonic()
+        available = [instance_id for instance_id in instances if self.is_available(instance_id, now)]
+        if instances and not available:
+            print("Every instance of the cluster is ejected, ignoring outlier detection")
+            return list(instances)
+        return available
+
+    '''
+    Description: Records the outcomes of benchmark or proxy requests, e.g. the results of traffic_trace.replay_trace, at the time they are read.
+                 A response that names its instance counts for that instance. A failed response (load balancer 5xx, non-JSON body)
+                 carries no instance ID: it is charged to the target registered for its path in the period it can have been sent in,
+                 and dropped when that is not a single instance.
+    Inputs:
+        results (list) - Dicts with 'backend', 'path' and 'status' keys.
+        target_history (TargetHistory) - The registered targets over time, or None to drop failed responses without a backend.
+        since (float) - The time.monotonic() timestamp from which the failed responses can have been sent.
+    '''
+    def record_results(self, results: list, target_history=None, since: float = None):
+        for result in results:
+            if result.get('backend'):
+                self.record(result['backend'], result.get('status') == 200)
+            elif target_history is not None and _is_server_error(result):
+                targets = target_history.targets_between(result.get('path'), since)
+                if len(targets) == 1:
+                    self.record(next(iter(targets)), False)
+
+def _is_server_error(result: dict):
+    return result.get('status') is not None and result['status'] >= 500
+
+'''
+Description: The targets registered for each path (cluster) over time, used to find which instance served a failed response.
+Inputs: retention (float) - Seconds of history kept.
+'''
+class TargetHistory:
+    def __init__(self, retention: float = 60.0):
+        self.retention = retention
+        self.changes = {}
+
+    '''
+    Description: Records the targets registered for a path from now on.
+    Inputs:
+        path (str) - The path served by the cluster, e.g. '/cluster1'.
+        targets (list) - The registered instance IDs.
+        now (float) - The time.monotonic() timestamp of the registration; defaults to now.
+    '''
+    def record(self, path: str, targets: list, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        changes = self.changes.setdefault(path, [])
+        if changes and changes[-1][1] == frozenset(targets):
+            return
+        changes.append((now, frozenset(targets)))
+        # Keep the last change before the retained period, it is still in effect at its start
+        while len(changes) > 1 and changes[1][0] < now - self.retention:
+            changes.pop(0)
+
+    '''
+    Description: Returns every target registered for a path at some point of a period.
+    Inputs:
+        path (str) - The path served by the cluster.
+        start (float) - The time.monotonic() timestamp of the start of the period.
+        end (float) - The end of the period; defaults to now.
+    Outputs: targets (set) - The instance IDs.
+    '''
+    def targets_between(self, path: str, start: float, end: float = None):
+        if end is None:
+            end = time.monotonic()
+        changes = self.changes.get(path, [])
+        targets = set()
+        for index, (changed_at, registered) in enumerate(changes):
+            replaced_at = changes[index + 1][0] if index + 1 < len(changes) else float('inf')
+            if changed_at <= end and replaced_at > start:
+                targets |= registered
+        return targets
+
+'''
+Description: Reads the outcomes appended to an outcome log since the last read. Each line of the log is a JSON object
+             with 'backend', 'path' and 'status' keys, written by a proxy or benchmark run in front of the cluster.
+Inputs:
+    log_path (str) - The path of the outcome log.
+    offset (int) - The file offset returned by the previous call, 0 to read from the start.
+Outputs: (outcomes, offset) (tuple) - The new outcomes and the offset to continue from.
+'''
+def read_outcome_log(log_path: str, offset: int):
+    if not os.path.exists(log_path):
+        return [], offset
+    outcomes = []
+    with open(log_path, 'r') as file:
+        if os.path.getsize(log_path) < offset:
+            # The log was truncated or rotated
+            offset = 0
+        file.seek(offset)
+        while True:
+            line = file.readline()
+            if not line.endswith('\n'):
+                # Stop before a partially written line, it is read once complete
+                break
+            offset = file.tell()
+            try:
+                outcomes.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping malformed outcome log line: {line.strip()}")
+    return outcomes, offset
+
+'''
+Description: Formats one response outcome as an outcome log line.
+Inputs: result (dict) - The outcome, with 'backend', 'path' and 'status' keys.
+Outputs: line (bytes) - The JSON line, or None for a request that failed without a response from the load balancer,
+         which says nothing about the instances.
+'''
+def format_outcome(result: dict):
+    if not result.get('backend') and not _is_server_error(result):
+        return None
+    outcome = {'backend': result.get('backend'), 'path': result.get('path'), 'status': result.get('status')}
+    return (json.dumps(outcome) + '\n').encode()
+
+'''
+Description: Appends response outcomes to an outcome log read by the traffic manager.
+Inputs:
+    log_path (str) - The path of the outcome log.
+    results (list) - Response outcomes, see format_outcome.
+'''
+def append_outcome_log(log_path: str, results: list):
+    with open(log_path, 'ab') as file:
+        for result in results:
+            line = format_outcome(result)
+            if line:
+                file.write(line)
+
+'''
+Description: Writes response outcomes to an outcome log as they complete. A background thread writes and flushes them every
+             `flush_interval` seconds, so that a slow file, such as the traffic manager's log opened over SFTP, does not
+             block the requests being measured.
+Inputs:
+    file (file) - The outcome log, opened for appending in binary mode; closed by close().
+    flush_interval (float) - Seconds between two writes of the queued outcomes.
+'''
+class OutcomeLogWriter:
+    def __init__(self, file, flush_interval: float = 0.1):
+        self.file = file
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _write_queued(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.file.write(b''.join(lines))
+            self.file.flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self._write_queued()
+            except Exception as e:
+                print(f"Error writing the outcome log: {str(e)}")
+
+    '''
+    Description: Queues one response outcome; usable as the on_result callback of traffic_trace.replay_trace.
+    Inputs: result (dict) - The outcome, see format_outcome.
+    '''
+    def write(self, result: dict):
+        line = format_outcome(result)
+        if line:
+            self.queue.put(line)
+
+    '''
+    Description: Writes the remaining outcomes and closes the log.
+    '''
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self._write_queued()
+        self.file.close()
@@ -0,0 +1,239 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+
+# File layout: a fixed header followed by `capacity` fixed-size records used as a ring.
+# Header: magic, version, record size, capacity, number of records ever written (the next slot is count % capacity).
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 64
+COUNT_OFFSET = 24
+MAGIC = b'PRBHIST1'
+VERSION = 1
+# Record: wall clock timestamp, instance index, latency in seconds (inf for failed probes), status, chosen flag.
+RECORD = struct.Struct('<dIfBB2x')
+
+STATUS_OK = 0
+STATUS_FAILED = 1
+
+'''
+Description: Append-only store of the traffic manager's probe samples and routing decisions, in a memory-mapped ring file of bounded size.
+             Recording a sample is a single struct.pack_into into the mapping, so it adds microseconds to a probe round.
+             Instance IDs are stored as indexes into a sidecar file (`<path>.ids`, one ID per line).
+Inputs:
+    path (str) - The path of the ring file, created if it does not exist.
+    capacity (int) - The number of records kept; the oldest are overwritten once it is full. Ignored for an existing file.
+'''
+class ProbeHistory:
+    def __init__(self, path: str, capacity: int = 1000000):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0).ljust(HEADER_SIZE, b'\0'))
+                file.truncate(HEADER_SIZE + capacity * RECORD.size)
+
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, record_size, self.capacity, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a version {VERSION} probe history file")
+
+        self.ids_path = path + '.ids'
+        self.instance_ids = load_instance_ids(self.ids_path)
+        self.instance_indexes = {instance_id: index for index, instance_id in enumerate(self.instance_ids)}
+        self.ids_file = open(self.ids_path, 'a')
+        self.round_timestamp = None
+
+    def _get_index(self, instance_id: str):
+        index = self.instance_indexes.get(instance_id)
+        if index is None:
+            index = self.instance_indexes[instance_id] = len(self.instance_ids)
+            self.instance_ids.append(instance_id)
+            self.ids_file.write(instance_id + '\n')
+            self.ids_file.flush()
+        return index
+
+    '''
+    Description: Appends one probe sample.
+    Inputs:
+        instance_id (str) - The ID of the probed instance.
+        latency (float) - The response time in seconds, infinity for a failed probe.
+        chosen (bool) - Whether the instance was selected as a target in this round.
+        timestamp (float) - The time.time() timestamp of the sample; defaults to now.
+    '''
+    def record(self, instance_id: str, latency: float, chosen: bool, timestamp: float = None):
+        status = STATUS_OK if latency != float('inf') else STATUS_FAILED
+        offset = HEADER_SIZE + (self.count % self.capacity) * RECORD.size
+        RECORD.pack_into(self.map, offset, time.time() if timestamp is None else timestamp, self._get_index(instance_id), latency, status, chosen)
+        # Publish the record only after it is written, so that readers never see a half-written slot as the newest one
+        self.count += 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    '''
+    Description: Starts a control loop iteration: every round recorded until the next call shares its timestamp,
+                 so that decision_at returns the decisions of all clusters of the iteration together.
+    '''
+    def begin_round(self):
+        self.round_timestamp = time.time()
+
+    '''
+    Description: Appends the samples of one probe round with the routing decision taken from them.
+    Inputs:
+        response_times (dict) - A mapping of probed instance ID to response time.
+        chosen (list) - The IDs of the instances selected as targets.
+    '''
+    def record_round(self, response_times: dict, chosen: list):
+        timestamp = self.round_timestamp if self.round_timestamp is not None else time.time()
+        for instance_id, latency in response_times.items():
+            self.record(instance_id, latency, instance_id in chosen, timestamp)
+
+    '''
+    Description: Flushes the mapping to disk and closes the store.
+    '''
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.ids_file.close()
+
+'''
+Description: Reads the instance IDs of a sidecar file.
+Inputs: ids_path (str) - The path of the sidecar file.
+Outputs: instance_ids (list) - The instance IDs, the position in the list being the index stored in the records.
+'''
+def load_instance_ids(ids_path: str):
+    if not os.path.exists(ids_path):
+        return []
+    with open(ids_path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+'''
+Description: Loads the records of a probe history file as a NumPy structured array in chronological order, without copying
+             more than a ring rotation. NumPy is only needed for reading, not on the instance that records the history.
+Inputs: path (str) - The path of the ring file.
+Outputs: (records, instance_ids) (tuple) - The records (fields timestamp, instance, latency, status, chosen) and the instance IDs.
+'''
+def load_history(path: str):
+    import numpy as np
+
+    record_dtype = np.dtype([('timestamp', '<f8'), ('instance', '<u4'), ('latency', '<f4'),
+                             ('status', 'u1'), ('chosen', 'u1'), ('padding', 'V2')])
+    with open(path, 'rb') as file:
+        magic, version, record_size, capacity, count = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or record_size != record_dtype.itemsize:
+        raise ValueError(f"{path} is not a version {VERSION} probe history file")
+
+    ring = np.memmap(path, dtype=record_dtype, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+    if count <= capacity:
+        records = ring[:count]
+    else:
+        start = count % capacity
+        records = np.concatenate((ring[start:], ring[:start]))
+    return records, load_instance_ids(path + '.ids')
+
+'''
+Description: Selects records by instance, time range and chosen flag.
+Inputs:
+    records (numpy.ndarray) - The records returned by load_history.
+    instance_ids (list) - The instance IDs returned by load_history.
+    instance_id (str) - Only keep samples of this instance, or None for all.
+    since (float) - Only keep samples at or after this timestamp, or None.
+    until (float) - Only keep samples before this timestamp, or None.
+    chosen (bool) - Only keep samples of chosen (True) or not chosen (False) instances, or None for both.
+Outputs: records (numpy.ndarray) - The matching records.
+'''
+def select(records, instance_ids: list, instance_id: str = None, since: float = None, until: float = None, chosen: bool = None):
+    import numpy as np
+
+    mask = np.ones(len(records), dtype=bool)
+    if instance_id is not None:
+        if instance_id not in instance_ids:
+            return records[:0]
+        mask &= records['instance'] == instance_ids.index(instance_id)
+    if since is not None:
+        mask &= records['timestamp'] >= since
+    if until is not None:
+        mask &= records['timestamp'] < until
+    if chosen is not None:
+        mask &= records['chosen'] == int(chosen)
+    return records[mask]
+
+'''
+Description: Computes per-instance probe statistics: sample count, failure ratio, times chosen and latency percentiles of successful probes.
+Inputs:
+    records (numpy.ndarray) - The records to summarize.
+    instance_ids (list) - The instance IDs returned by load_history.
+    percentiles (list) - The latency percentiles to compute.
+Outputs: summary (dict) - A mapping of instance ID to its statistics.
+'''
+def summarize(records, instance_ids: list, percentiles: list = (50, 90, 99)):
+    import numpy as np
+
+    summary = {}
+    ok = records['status'] == STATUS_OK
+    counts = np.bincount(records['instance'], minlength=len(instance_ids))
+    failures = np.bincount(records['instance'][~ok], minlength=len(instance_ids))
+    chosen = np.bincount(records['instance'][records['chosen'] == 1], minlength=len(instance_ids))
+
+    # Sort successful samples by instance then latency, so each instance's latencies are one contiguous sorted slice
+    ok_records = records[ok]
+    order = np.lexsort((ok_records['latency'], ok_records['instance']))
+    sorted_instances = ok_records['instance'][order]
+    sorted_latencies = ok_records['latency'][order]
+    bounds = np.searchsorted(sorted_instances, np.arange(len(instance_ids) + 1))
+
+    for index, instance_id in enumerate(instance_ids):
+        if not counts[index]:
+            continue
+        latencies = sorted_latencies[bounds[index]:bounds[index + 1]]
+        summary[instance_id] = {
+            'samples': int(counts[index]),
+            'failure_ratio': float(failures[index] / counts[index]),
+            'chosen': int(chosen[index]),
+            'latency': {p: float(np.percentile(latencies, p)) for p in percentiles} if len(latencies) else {},
+        }
+    return summary
+
+'''
+Description: Reconstructs the control loop iteration that was the last one at or before a given time: every sample of every cluster
+             and which instances were chosen.
+Inputs:
+    records (numpy.ndarray) - The records returned by load_history.
+    instance_ids (list) - The instance IDs returned by load_history.
+    timestamp (float) - The time to look at.
+Outputs: samples (list) - (instance ID, latency, chosen) tuples of the samples that share the latest timestamp at or before `timestamp`.
+'''
+def decision_at(records, instance_ids: list, timestamp: float):
+    import numpy as np
+
+    # Records are chronological, so the timestamps are sorted
+    position = np.searchsorted(records['timestamp'], timestamp, side='right')
+    if position == 0:
+        return []
+    round_time = records['timestamp'][position - 1]
+    first = np.searchsorted(records['timestamp'], round_time, side='left')
+    return [
+        (instance_ids[record['instance']], float(record['latency']), bool(record['chosen']))
+        for record in records[first:position]
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the probe history recorded by the traffic manager.")
+    parser.add_argument('path', help="the probe history file")
+    parser.add_argument('--since', type=float, help="only use samples at or after this Unix timestamp")
+    parser.add_argument('--until', type=float, help="only use samples before this Unix timestamp")
+    parser.add_argument('--at', type=float, help="show the probe round and routing decision in effect at this Unix timestamp")
+    args = parser.parse_args()
+
+    records, instance_ids = load_history(args.path)
+    print(f"{len(records)} samples of {len(instance_ids)} instances")
+    if args.at is not None:
+        for instance_id, latency, chosen in decision_at(records, instance_ids, args.at):
+            print(f"{instance_id}: {latency:.4f} seconds{' (chosen)' if chosen else ''}")
+    else:
+        records = select(records, instance_ids, since=args.since, until=args.until)
+        for instance_id, stats in summarize(records, instance_ids).items():
+            latency = ', '.join(f"p{p}: {value:.4f}s" for p, value in stats['latency'].items())
+            print(f"{instance_id}: {stats['samples']} samples, {stats['failure_ratio']:.1%} failed, chosen {stats['chosen']} times, {latency}")
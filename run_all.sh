@@ -14,7 +14,7 @@ if [ $? -eq 0 ]; then
 
     # Check if benchmark.py executed successfully
     if [ $? -eq 0 ]; then
-        echo "benchmark.py executed successfully. Results saved to benchmark_results.txt."
+        echo "benchmark.py executed successfully. Results saved to benchmark_results.txt and benchmark_runs/."
     else
         echo "Error: benchmark.py failed to execute."
     fi
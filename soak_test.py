@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+import aiohttp
+import benchmark_store as bs
+import traffic_trace as tt
+
+'''
+Description: Per-interval accumulator for one endpoint: completed requests, errors, latencies and serving backends.
+'''
+class IntervalStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+        self.backends = {}
+
+    def add(self, status_code, latency: float, backend_id):
+        self.requests += 1
+        if status_code != 200:
+            self.errors += 1
+            return
+        self.latencies.append(latency)
+        if backend_id:
+            self.backends[backend_id] = self.backends.get(backend_id, 0) + 1
+
+'''
+Description: Returns the registered targets of a target group and their health state.
+Inputs:
+    elb_client (boto3.client) - The ELB client instance.
+    target_group_arn (str) - The ARN of the target group.
+Outputs: targets (dict) - A mapping of instance ID to health state, or None if the lookup failed.
+'''
+def get_target_states(elb_client, target_group_arn: str):
+    try:
+        response = elb_client.describe_target_health(TargetGroupArn=target_group_arn)
+    except Exception as e:
+        print(f"Error fetching target health: {str(e)}")
+        return None
+    return {target['Target']['Id']: target['TargetHealth']['State'] for target in response['TargetHealthDescriptions']}
+
+'''
+Description: Polls the target groups and appends an annotation to `annotations` every time the registered target set changes.
+Inputs:
+    elb_client (boto3.client) - The ELB client instance.
+    target_groups (dict) - A mapping of target group name to ARN.
+    annotations (list) - The list the annotations are appended to; the soak loop drains it into the next time series point.
+    start_time (float) - The time.monotonic() timestamp of the start of the soak test.
+    poll_interval (float) - Seconds between polls.
+'''
+async def watch_target_groups(elb_client, target_groups: dict, annotations: list, start_time: float, poll_interval: float):
+    loop = asyncio.get_running_loop()
+    previous = {}
+    while True:
+        for name, arn in target_groups.items():
+            # boto3 is blocking, keep it off the event loop so that the load generator stays on schedule
+            states = await loop.run_in_executor(None, get_target_states, elb_client, arn)
+            if states is None:
+                continue
+            registered = set(states)
+            if name in previous and registered != previous[name]:
+                annotations.append({
+                    'event': 'target_change',
+                    't': round(time.monotonic() - start_time, 3),
+                    'target_group': name,
+                    'added': sorted(registered - previous[name]),
+                    'removed': sorted(previous[name] - registered),
+                    'targets': states,
+                })
+            previous[name] = registered
+        await asyncio.sleep(poll_interval)
+
+async def _soak_request(session, url: str, endpoint: str, stats: dict):
+    sent_at = time.monotonic()
+    try:
+        async with session.get(url, headers={'content-type': 'application/json'}) as response:
+            status_code = response.status
+            backend_id = tt.get_backend_id(await response.json())
+    except Exception:
+        status_code, backend_id = None, None
+    # Requests are counted in the interval they complete in
+    stats[endpoint].add(status_code, time.monotonic() - sent_at, backend_id)
+
+'''
+Description: Builds the time series point of one interval and folds its latencies into the run totals.
+Inputs:
+    t (float) - Seconds since the start of the soak test at the end of the interval.
+    interval (float) - Length of the interval in seconds.
+    stats (dict) - A mapping of endpoint to the IntervalStats of the interval.
+    totals (dict) - A mapping of endpoint to the accumulated {requests, errors, histogram}, updated in place.
+    annotations (list) - Target set changes observed during the interval.
+Outputs: point (dict) - The time series point.
+'''
+def build_point(t: float, interval: float, stats: dict, totals: dict, annotations: list):
+    point = {'t': round(t, 3), 'endpoints': {}}
+    for endpoint, endpoint_stats in stats.items():
+        latencies = sorted(endpoint_stats.latencies)
+        point['endpoints'][endpoint] = {
+            'requests': endpoint_stats.requests,
+            'throughput': round(endpoint_stats.requests / interval, 2),
+            'error_rate': round(endpoint_stats.errors / endpoint_stats.requests, 4) if endpoint_stats.requests else 0.0,
+            'p50': bs.percentile(latencies, 50),
+            'p90': bs.percentile(latencies, 90),
+            'p99': bs.percentile(latencies, 99),
+            'backends': endpoint_stats.backends,
+        }
+        total = totals[endpoint]
+        total['requests'] += endpoint_stats.requests
+        total['errors'] += endpoint_stats.errors
+        bs.merge_histograms(total['histogram'], bs.build_histogram(latencies))
+    if annotations:
+        point['annotations'] = annotations
+    return point
+
+'''
+Description: Keeps a constant request rate against the load balancer for a long time and streams one JSON time series point per interval,
+             with throughput, error rate and latency percentiles per endpoint, annotated with the target set changes seen meanwhile.
+Inputs:
+    dns_name (str) - The DNS name of the load balancer.
+    endpoints (list) - The paths to request, in round-robin order.
+    rate (float) - Target requests per second over all endpoints.
+    duration (float) - Length of the soak test in seconds.
+    interval (float) - Length of a time series interval in seconds.
+    elb_client (boto3.client) - The ELB client used to watch the target groups, or None to disable annotations.
+    target_groups (dict) - A mapping of target group name to ARN to watch.
+    output_path (str) - A file the time series is also appended to as JSON lines, or None.
+    max_connections (int) - The maximum number of concurrent connections to the load balancer.
+Outputs: totals (dict) - A mapping of endpoint to the accumulated {requests, errors, histogram} of the whole run.
+'''
+async def run_soak(dns_name: str, endpoints: list, rate: float, duration: float, interval: float = 1.0,
+                   elb_client=None, target_groups: dict = None, output_path: str = None, max_connections: int = 100):
+    loop = asyncio.get_running_loop()
+    stats = {endpoint: IntervalStats() for endpoint in endpoints}
+    totals = {endpoint: {'requests': 0, 'errors': 0, 'histogram': bs.build_histogram([])} for endpoint in endpoints}
+    annotations = []
+    output = open(output_path, 'a') if output_path else None
+
+    start_time = time.monotonic()
+    watcher = None
+    if elb_client is not None and target_groups:
+        watcher = loop.create_task(watch_target_groups(elb_client, target_groups, annotations, start_time, interval))
+
+    def emit(now: float, interval_length: float):
+        point = build_point(now - start_time, interval_length, dict(stats), totals, annotations[:])
+        annotations.clear()
+        # Reset in place: in-flight requests look their endpoint up in `stats` when they complete
+        for endpoint in endpoints:
+            stats[endpoint] = IntervalStats()
+        line = json.dumps(point)
+        print(line, flush=True)
+        if output:
+            output.write(line + '\n')
+            output.flush()
+
+    pending = set()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_connections)) as session:
+            request_num = 0
+            next_emit = start_time + interval
+            while True:
+                now = time.monotonic()
+                if now >= next_emit:
+                    emit(now, interval)
+                    next_emit += interval
+                if now - start_time >= duration:
+                    break
+
+                # Open-loop arrivals: request n is due at start + n / rate, regardless of how slow earlier ones are
+                due = start_time + request_num / rate
+                if due <= now:
+                    endpoint = endpoints[request_num % len(endpoints)]
+                    task = loop.create_task(_soak_request(session, f"http://{dns_name}{endpoint}", endpoint, stats))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    request_num += 1
+                else:
+                    await asyncio.sleep(min(due, next_emit) - now)
+
+            # Requests still in flight at the end go into a last, shorter interval
+            if pending:
+                await asyncio.gather(*pending)
+            if any(endpoint_stats.requests for endpoint_stats in stats.values()):
+                final_time = time.monotonic()
+                emit(final_time, final_time - (next_emit - interval))
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if output:
+            output.close()
+    return totals
@@ -1,9 +1,9 @@
-import boto3
 import requests
+import aws_clients
 import globals as g
 
-# Initialize EC2 client
-ec2_client = boto3.client('ec2')
+# Get the shared EC2 client
+ec2_client = aws_clients.get_client('ec2')
 
 # Filter by security group name
 security_group_name_to_filter = g.security_group_name
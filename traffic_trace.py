@@ -0,0 +1,163 @@
+import asyncio
+import time
+import aiohttp
+
+# Trace format: one request per line, tab separated, sorted by offset.
+#   <offset in seconds since trace start>\t<path>\t<expected backend instance ID>
+# Lines starting with '#' are comments. An unknown backend is written as '-'.
+TRACE_HEADER = '# offset\tpath\texpected_backend'
+UNKNOWN_BACKEND = '-'
+
+'''
+Description: Extracts the ID of the instance that served a request from the JSON body returned by the FastAPI backends.
+Inputs: response_json (dict) - The decoded response body, e.g. {'Cluster1 has received the request on Instance: ': 'i-0123'}.
+Outputs: backend_id (str) - The instance ID, or None if it cannot be found.
+'''
+def get_backend_id(response_json):
+    if isinstance(response_json, dict):
+        for value in response_json.values():
+            if isinstance(value, str) and value.startswith('i-'):
+                return value
+    return None
+
+'''
+Description: Collects (offset, path, expected backend) entries while traffic is generated or proxied, and saves them as a trace.
+             Callers pass the time the request was sent so that concurrent requests keep their original inter-arrival times.
+'''
+class TraceRecorder:
+    def __init__(self):
+        self.start_time = None
+        self.entries = []
+
+    '''
+    Description: Records one request.
+    Inputs:
+        path (str) - The request path, e.g. '/cluster1'.
+        backend_id (str) - The instance that served the request, or None if unknown.
+        sent_at (float) - The time.monotonic() timestamp the request was sent at; defaults to now.
+    '''
+    def record(self, path: str, backend_id=None, sent_at=None):
+        if sent_at is None:
+            sent_at = time.monotonic()
+        if self.start_time is None or sent_at < self.start_time:
+            self.start_time = sent_at
+        self.entries.append((sent_at, path, backend_id))
+
+    '''
+    Description: Returns the recorded requests as trace entries, with offsets relative to the first request.
+    Outputs: entries (list) - A list of (offset, path, expected backend) tuples sorted by offset.
+    '''
+    def get_entries(self):
+        return sorted(
+            (sent_at - self.start_time, path, backend_id)
+            for sent_at, path, backend_id in self.entries
+        )
+
+    '''
+    Description: Writes the recorded requests to a trace file.
+    Inputs: file_path (str) - The path of the trace file to write.
+    '''
+    def save(self, file_path: str):
+        write_trace(file_path, self.get_entries())
+        print(f"Saved {len(self.entries)} requests to trace {file_path}")
+
+'''
+Description: Writes trace entries to a file in the compact trace format.
+Inputs:
+    file_path (str) - The path of the trace file to write.
+    entries (list) - A list of (offset, path, expected backend) tuples.
+'''
+def write_trace(file_path: str, entries: list):
+    with open(file_path, 'w') as file:
+        file.write(TRACE_HEADER + '\n')
+        for offset, path, backend_id in entries:
+            file.write(f"{offset:.6f}\t{path}\t{backend_id or UNKNOWN_BACKEND}\n")
+
+'''
+Description: Reads a trace file written by write_trace or TraceRecorder.save.
+Inputs: file_path (str) - The path of the trace file to read.
+Outputs: entries (list) - A list of (offset, path, expected backend) tuples sorted by offset.
+'''
+def read_trace(file_path: str):
+    entries = []
+    with open(file_path, 'r') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 3:
+                raise ValueError(f"{file_path}:{line_number}: expected 3 tab separated fields, got {len(fields)}")
+            offset, path, backend_id = fields
+            entries.append((float(offset), path, None if backend_id == UNKNOWN_BACKEND else backend_id))
+    entries.sort()
+    return entries
+
+async def _replay_request(session, url: str, entry: tuple, scheduled_at: float, sent_at: float, on_result=None):
+    offset, path, expected_backend = entry
+    status_code, backend_id = None, None
+    try:
+        async with session.get(url, headers={'content-type': 'application/json'}) as response:
+            # Keep the status of error responses (e.g. a load balancer 502), whose body is not the backend's JSON
+            status_code = response.status
+            backend_id = get_backend_id(await response.json(content_type=None))
+    except Exception as e:
+        print(f"Replay of {path} at offset {offset:.3f}s failed - {str(e)}")
+    result = {
+        'offset': offset,
+        'path': path,
+        'expected_backend': expected_backend,
+        'backend': backend_id,
+        'status': status_code,
+        'latency': time.monotonic() - sent_at,
+        'lag': sent_at - scheduled_at,
+    }
+    if on_result is not None:
+        on_result(result)
+    return result
+
+'''
+Description: Reissues the requests of a trace against the load balancer, keeping the original inter-arrival times.
+Inputs:
+    dns_name (str) - The DNS name of the load balancer.
+    entries (list) - A list of (offset, path, expected backend) tuples, as returned by read_trace.
+    speed (float) - Replay speed factor; 2.0 replays twice as fast, 0 sends every request without pacing.
+    max_connections (int) - The maximum number of concurrent connections to the load balancer.
+    on_result (callable) - Called with each result as soon as its request completes, or None.
+Outputs: results (list) - One dict per request with offset, path, expected_backend, backend, status, latency and lag
+         (how late the request was sent compared to its scheduled time, in seconds).
+'''
+async def replay_trace(dns_name: str, entries: list, speed: float = 1.0, max_connections: int = 100, on_result=None):
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start_time = time.monotonic()
+        tasks = []
+        for entry in entries:
+            scheduled_at = start_time + (entry[0] / speed if speed > 0 else 0)
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            url = f"http://{dns_name}{entry[1]}"
+            tasks.append(loop.create_task(_replay_request(session, url, entry, scheduled_at, time.monotonic(), on_result)))
+        return await asyncio.gather(*tasks)
+
+'''
+Description: Prints a summary of a trace replay: request counts, failures, backend mismatches, latency and pacing lag.
+Inputs: results (list) - The results returned by replay_trace.
+'''
+def print_replay_summary(results: list):
+    if not results:
+        print("Trace is empty, nothing was replayed.")
+        return
+
+    failed = [r for r in results if r['status'] != 200]
+    compared = [r for r in results if r['expected_backend'] and r['backend']]
+    mismatched = [r for r in compared if r['backend'] != r['expected_backend']]
+    latencies = sorted(r['latency'] for r in results)
+    lags = [r['lag'] for r in results]
+
+    print(f"\nReplayed {len(results)} requests, {len(failed)} failed")
+    print(f"Backend differs from trace for {len(mismatched)} of {len(compared)} comparable requests")
+    print(f"Latency p50: {latencies[len(latencies) // 2]:.4f} seconds, max: {latencies[-1]:.4f} seconds")
+    print(f"Pacing lag mean: {sum(lags) / len(lags):.4f} seconds, max: {max(lags):.4f} seconds")